@@ -3,15 +3,32 @@
 # hg - one set of targets and one set of constraints
 # minusone - one set of targets, removing one constraint from the given set each time
 # all - on each file beginning with "trg" in a given folder (i.e., for all participants in a folder)
+# restarts - one set of targets and one set of constraints, from many random initial weights learned in lockstep
+# lp - one set of targets and one set of constraints, solved exactly as a linear program instead of with the GLA
+# sweep - one set of targets and one set of constraints, learned with every combination of rates, iterations,
+#         initializations and seeds from given grids
+# maxent - one set of targets and one set of constraints, learned as a probabilistic MaxEnt (or Noisy HG) grammar
+# cross - the best grammar of each participant of an all_HGlog file, evaluated on the targets of every participant
+# search - one set of targets, looking for the smallest sets of the given constraints that are enough for every target to win
 
 import sys
 import re
 import random
 import datetime
+import itertools
+import time
 import numpy as np
 import os
 import glob
+import StringIO
 import HGlearn12 as hg
+import HGpool
+import HGlp
+import HGmaxent
+import HGmetrics
+import HGlogger
+import HGcheckpoint
+import HGsearch
 
 ######
 
@@ -19,7 +36,7 @@ import HGlearn12 as hg
 ## or run consecutively for all participant files in a directory
 
 def main():
-    flags = ['hg', 'minusone', 'all', 'countcands']
+    flags = ['hg', 'minusone', 'all', 'countcands', 'restarts', 'lp', 'sweep', 'maxent', 'cross', 'search']
     flag = get_flag(flags)
 
     while True:
@@ -46,7 +63,7 @@ def main():
     if change_dir == 'n':
         eval_files_dir = os.getcwd()
     else:
-        eval_files_dir = raw_input('Enter the directory where eval files are located: ')
+        eval_files_dir = raw_input('Enter the directory (or zip archive) where eval files are located: ')
     print "Eval files directory set to %s" % (eval_files_dir)
 
     if flag == 'hg':
@@ -62,6 +79,23 @@ def main():
     elif flag == 'countcands':
         cand_nums = count_cands(eval_files_dir)
 
+    elif flag == 'restarts':
+        restart_letters = restarts(eval_files_dir, iterations, rate, uni)
+
+    elif flag == 'lp':
+        lp_letters = linear_program(eval_files_dir, override = 0)
+
+    elif flag == 'sweep':
+        configurations = sweep(eval_files_dir, iterations, rate, uni)
+
+    elif flag == 'maxent':
+        maxent_letters = maxent(eval_files_dir, iterations, rate, uni)
+
+    elif flag == 'cross':
+        accuracies = cross_participants(eval_files_dir)
+
+    elif flag == 'search':
+        smallest = search_constraints(eval_files_dir, iterations, rate, uni)
 
     else:
         exit()
@@ -74,7 +108,13 @@ def get_flag(flags):
                'hg - calculate the optimal weights based on given constraints file and targets file\n' \
                'minusOne - run the script removing one of the constraints each time\n' \
                'all - run the script on all target files in a given directory\n' \
-               'countCands - return the number of candidates for each letter-shape and for all of the letter shapes in a given targets file'
+               'countCands - return the number of candidates for each letter-shape and for all of the letter shapes in a given targets file\n' \
+               'restarts - run many random restarts of the GLA at once and report the best one and the distribution of accuracies\n' \
+               'lp - find the weights exactly as a linear program, or the smallest set of rankings that no weights can satisfy\n' \
+               'sweep - run the script for every combination of given learning rates, iterations, initializations and seeds\n' \
+               'maxent - fit the weights of a probabilistic MaxEnt (or Noisy HG) grammar by batch gradient ascent\n' \
+               'cross - evaluate the best grammar of each participant of an all_HGlog file on the targets of every participant\n' \
+               'search - find the smallest sets of constraints that are enough for every target to win'
 
     if len(sys.argv) != 2:
         print not_flag
@@ -113,8 +153,304 @@ def harmonic_grammar(eval_files_dir, iterations, rate, uni, override):
     hg_letters = hg.main(eval_files_dir, constraints, targets_filename, iterations, rate, uni, override)
     return(hg_letters)
 
+## Finds the weights exactly as a linear program instead of with the GLA, or shows that no weights exist
+def linear_program(eval_files_dir, override):
+    constraints_file = raw_input('Enter the name of the constraints file: ')
+    targets_filename = raw_input('Enter the name of the targets file: ')
+    while True:
+        non_neg = raw_input('Constrain the weights to be non-negative? y/n ').lower()
+        if non_neg not in ('y', 'n'):
+            print 'Sorry, I didn\'t get that...'
+            continue
+        else:
+            break
+    no_neg = 1 if non_neg == 'y' else 0
+    constraints = hg.get_constraints(constraints_file)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+
+    data = hg.get_data(targets_filename)
+    print 'Found %d targets...\n' % (len(data))
+    logf = hg.create_log_file(targets_filename, override)
+
+    print 'Solving the linear program...'
+    (final_result, violated, failed_letters) = solve_linear_program(grammar, constraints, data, no_neg, logf)
+    logf.close()
+    if final_result is None:
+        return(violated)
+    return(failed_letters)
+
+# Solves for the weights of the lp mode (also run by HGbatch) and writes them to the log, or the smallest set of
+# rankings that cannot hold together when there are no such weights
+# Returns the adjust_weights-style result (None when infeasible), the rankings that cannot hold together and the failures
+def solve_linear_program(grammar, constraints, data, no_neg, logf):
+    non_neg = 'y' if no_neg == 1 else 'n'
+    (weights, violated) = HGlp.solve(hg.prune_grammar(grammar, data, no_neg), data, no_neg)
+    if weights is None:
+        text = '\nNo weights rank every target above all of its competitors (non-negative weights: %s)\n' \
+               'Smallest set of rankings that cannot hold together:\nLetter\tTarget\tCompetitor\n' % (non_neg)
+        for pair in violated:
+            text = text + '%s\t%s\t%s\n' % pair
+        logf.write(text)
+        print text
+        return (None, violated, [])
+
+    accuracy = hg.evaluate(weights, grammar, data)
+    summary_text = '\nSolved as a linear program (non-negative weights: %s)\nAccuracy: %.2f\nGrammar for max accuracy:\t%s\nConstraints:\t%s' \
+                   % (non_neg, accuracy, '\t'.join(map(str, [round(wt, 2) for wt in weights])), '\t'.join(map(str, constraints)))
+    logf.write(summary_text)
+    print summary_text
+    final_result = [accuracy, 0, weights, weights, 0, 0, 0]
+    failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf, 1 if accuracy == 1 else 0)
+    return (final_result, violated, failed_letters)
+
+## Finds the smallest sets of the given constraints that are enough for every target to win: greedy backward
+## elimination from the full set, each smaller set learned from the weights of the set it came from, then every set of up
+## to a given size. Sets inside a set shown to be infeasible are never learned (see HGsearch)
+def search_constraints(eval_files_dir, iterations, rate, uni, seed = None):
+    constraints_file = raw_input('Enter the name of the constraints file: ')
+    targets_filename = raw_input('Enter the name of the targets file: ')
+    max_size = raw_input('Also try every set of up to how many constraints? (blank for 0, i.e. none): ')
+    max_size = int(max_size) if max_size.strip() != '' else 0
+    constraints = hg.get_constraints(constraints_file)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+
+    data = hg.get_data(targets_filename)
+    print 'Found %d targets...\n' % (len(data))
+
+    if seed is None:
+        seed = random.randint(1, 1000000)
+    (searcher, smallest, minimal, log_filename) = run_search(grammar, constraints, data, targets_filename, iterations, rate,
+                                                             uni, max_size, seed)
+    return (smallest)
+
+# Runs the search mode (also run by HGbatch) from a seed, and writes it to a new HGlog_Search file
+# Returns the search, the set found by backward elimination, the minimal sets of up to max_size constraints and the
+# name of the log
+def run_search(grammar, constraints, data, targets_filename, iterations, rate, uni, max_size, seed):
+    HGpool.seed_job(seed)
+    ID = determine_id(targets_filename)
+    now = datetime.datetime.now()
+    logf = hg.open_new_file('HGlog_Search_%d-%d-%d_%s_%%d.txt' % (now.year, now.month, now.day, ID))
+    logf.write('%s\nConstraints:\t%s\nSeed:\t%d\n' % (ID, '\t'.join(map(str, constraints)), seed))
+    (searcher, smallest, minimal) = HGsearch.search(grammar, data, constraints, iterations, rate, uni, max_size)
+    HGsearch.write_log(searcher, smallest, minimal, max_size, logf)
+    logf.close()
+    return (searcher, smallest, minimal, logf.name)
+
+## Fits the weights of a MaxEnt grammar (or of a Noisy HG grammar, with noise > 0) to the targets by batch gradient
+## ascent on their log-likelihood, and logs the weights with the best accuracy, the final weights and the probability
+## that the final grammar gives the targets of each letter
+def maxent(eval_files_dir, iterations, rate, uni):
+    constraints_file = raw_input('Enter the name of the constraints file: ')
+    targets_filename = raw_input('Enter the name of the targets file: ')
+    noise = raw_input('Enter the standard deviation of the noise on the weights (blank for 0, i.e. MaxEnt): ')
+    noise = float(noise) if noise.strip() != '' else 0.0
+    constraints = hg.get_constraints(constraints_file)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+
+    data = hg.get_data(targets_filename)
+    print 'Found %d targets...\n' % (len(data))
+    logf = hg.create_log_file(targets_filename, 0)
+
+    weights = hg.initialize_weights(uni, constraints)
+    print 'Fitting the weights...'
+    (final_result, final_weights, log_likelihood) = HGmaxent.adjust_weights(iterations, data, grammar, weights, rate, 1, noise)
+    logf.write('MaxEnt grammar (noise: %g)' % (noise))
+    full_success = hg.write_summary(final_result, constraints, logf)
+
+    probabilities = HGmaxent.StackedTableaux(grammar, data).target_probabilities(final_weights)
+    text = '\n\nFinal grammar:\t%s\nLog-likelihood of the targets:\t%.4f\n\nLetter\tTargets\tProbability of the targets\n' \
+           % ('\t'.join(map(str, [round(wt, 2) for wt in final_weights])), log_likelihood)
+    for ((letter, target, n), p) in zip(data, probabilities.tolist()):
+        text = text + '%s\t%s\t%.4f\n' % (letter, ', '.join(target), p)
+    logf.write(text)
+    print text
+    failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf, full_success)
+    logf.close()
+    return(failed_letters)
+
+## Runs many random restarts of the GLA in lockstep on one set of targets, and logs the best one and how the
+## accuracies of all the restarts are distributed
+def restarts(eval_files_dir, iterations, rate, uni, n_restarts = None):
+    constraints_file = raw_input('Enter the name of the constraints file: ')
+    targets_filename = raw_input('Enter the name of the targets file: ')
+    if n_restarts is None:
+        n_restarts = int(raw_input('Enter the number of restarts: '))
+    constraints = hg.get_constraints(constraints_file)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+
+    data = hg.get_data(targets_filename)
+    print 'Found %d targets...\n' % (len(data))
+    logf = hg.create_log_file(targets_filename, 0)
+
+    print 'Looking for optimal weights from %d random restarts...' % (n_restarts)
+    (results, best, failed_letters) = run_restarts(grammar, constraints, data, iterations, rate, uni, n_restarts, logf)
+    logf.close()
+
+    return(failed_letters)
+
+# Learns from the random restarts of the restarts mode (also run by HGbatch) and writes the best one and the accuracies of
+# all of them to the log
+# Returns the adjust_weights-style results of the restarts, the index of the best one and its failures
+def run_restarts(grammar, constraints, data, iterations, rate, uni, n_restarts, logf):
+    sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+    (results, best) = hg.adjust_weights_restarts(iterations, data, hg.prune_grammar(grammar, data), constraints,
+                                                 n_restarts, rate, uni, sum_of_relative_frequencies, 1)
+
+    print 'Best restart: %d' % (best + 1)
+    logf.write('Restarts:\t%d\nBest restart:\t%d' % (n_restarts, best + 1))
+    full_success = hg.write_summary(results[best], constraints, logf)
+    failed_letters = hg.find_failures(grammar, data, constraints, results[best], logf, full_success)
+
+    accuracies = [result[0] for result in results]
+    text = '\n\nMax Accuracy\tRestarts\n'
+    for accuracy in sorted(set(accuracies), reverse = True):
+        text = text + '%.2f\t%d\n' % (accuracy, accuracies.count(accuracy))
+    text = text + '\nRestart\tMax Accuracy\tIteration for Max\tTotal Samples\tRandom Seed\n'
+    for r in range(n_restarts):
+        text = text + '%d\t%.2f\t%d\t%d\t%d\n' % (r + 1, results[r][0], results[r][1], results[r][5], results[r][6])
+    logf.write(text)
+    print text
+    return (results, best, failed_letters)
+
+## Runs the GLA for every combination of learning rates, iterations, weight initializations and seeds, and logs the
+## accuracy, samples to max accuracy and time of each configuration. The runs share the grammar and run in a pool of
+## processes; a run that falls more than `margin` below the best accuracy reached by the same number of samples is
+## stopped early (margin=1 never stops a run)
+def sweep(eval_files_dir, iterations, rate, uni, processes = None, margin = None):
+    constraints_file = raw_input('Enter the name of the constraints file: ')
+    targets_filename = raw_input('Enter the name of the targets file: ')
+    rates = parse_grid(raw_input('Enter the learning rates (e.g. 0.05,0.1,0.2 or 0.05:0.3:0.05; blank for %s): ' % (rate)), float, [rate])
+    iterations_grid = parse_grid(raw_input('Enter the numbers of iterations (e.g. 500,1000 or 500:2000:500; blank for %d): ' % (iterations)), int, [iterations])
+    unis = parse_grid(raw_input('Enter the weight initializations (0 = random, 1 = uniform, or 0,1; blank for %d): ' % (uni)), int, [uni])
+    seeds = parse_grid(raw_input('Enter the random seeds (e.g. 1,2,3 or 1:10; blank for 1:5): '), int, range(1, 6))
+    if margin is None:
+        margin = parse_grid(raw_input('Stop runs whose accuracy falls this far behind the best one (blank for 0.1, 1 = never): '), float, [0.1])[0]
+    constraints = hg.get_constraints(constraints_file)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+    eval_filenames = hg.get_eval_files(eval_files_dir)[0]
+
+    data = hg.get_data(targets_filename)
+    print 'Found %d targets...\n' % (len(data))
+
+    # Every configuration is run with every seed; the seeds come first so that the configurations race side by side
+    configurations = list(itertools.product(rates, iterations_grid, unis))
+    jobs = [(configuration, seed) for seed in seeds for configuration in configurations]
+    board = HGpool.EarlyStopBoard(20 * max(iterations_grid) + 10 * len(data), 100, margin)
+    shared = {'grammar': hg.prune_grammar(grammar, data), 'data': data, 'constraints': constraints, 'board': board,
+              'margin': margin}
+    print 'Running %d configurations with %d seeds each...\n' % (len(configurations), len(seeds))
+    # Only finished runs are checkpointed: a resumed sweep starts its unfinished runs over, and its early stopping only
+    # compares them with the runs that finish after the resumption
+    checkpoint = HGcheckpoint.open_run('sweep', eval_filenames, [targets_filename], constraints, rates, iterations_grid, unis,
+                                       seeds, margin, hg.no_neg, hg.sampling, hg.batch_size)
+    results = run_checkpointed_jobs(run_sweep_point, jobs, processes, shared, checkpoint, jobs)
+
+    ID = determine_id(targets_filename)
+    now = datetime.datetime.now()
+    logf = hg.open_new_file('HGlog_Sweep_%d-%d-%d_%s_%%d.txt' % (now.year, now.month, now.day, ID))
+    logf.write('%s\nConstraints:\t%s\n\nRate\tIterations\tUni\tSeed\tMax Accuracy\tIteration for Max\tSamples for Max\tTotal Samples\tSeconds\tStopped Early\n'
+               % (ID, '\t'.join(map(str, constraints))))
+    for ((configuration, seed), (final_result, seconds, stopped)) in zip(jobs, results):
+        logf.write('%s\t%d\t%d\t%d\t%.2f\t%d\t%d\t%d\t%.2f\t%s\n' % (configuration + (seed, final_result[0], final_result[1],
+                   final_result[4], final_result[5], seconds, 'yes' if stopped else 'no')))
+
+    # One line per configuration, the best first
+    summary = []
+    for configuration in configurations:
+        runs = [result for (job, result) in zip(jobs, results) if job[0] == configuration]
+        accuracies = [final_result[0] for (final_result, seconds, stopped) in runs]
+        summary.append((configuration, np.mean(accuracies), max(accuracies), accuracies.count(1.0),
+                        np.mean([final_result[4] for (final_result, seconds, stopped) in runs]),
+                        np.mean([seconds for (final_result, seconds, stopped) in runs]),
+                        len([stopped for (final_result, seconds, stopped) in runs if stopped])))
+    summary.sort(key = lambda line: (-line[1], line[4]))
+    text = '\n\nRate\tIterations\tUni\tRuns\tMean Max Accuracy\tBest Max Accuracy\tRuns with Accuracy 1\tMean Samples for Max\tMean Seconds\tStopped Early\n'
+    for (configuration, mean_accuracy, best_accuracy, n_perfect, mean_samples, mean_seconds, n_stopped) in summary:
+        text = text + '%s\t%d\t%d\t%d\t%.3f\t%.2f\t%d\t%.1f\t%.2f\t%d\n' % (configuration + (len(seeds), mean_accuracy, best_accuracy,
+                                                                             n_perfect, mean_samples, mean_seconds, n_stopped))
+    logf.write(text)
+    print text
+    logf.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+    return (summary)
+
+# Runs the GLA for one configuration and seed (one job of sweep), returning its result, its time and whether it was
+# stopped early
+def run_sweep_point(job):
+    ((rate, iterations, uni), seed) = job
+    shared = HGpool.shared
+    HGpool.seed_job(seed)
+    board = shared['board']
+    data = shared['data']
+    stopped = []
+
+    # Give up when the run is clearly behind the others
+    def monitor(s, max_accuracy):
+        if board.dominated(s, max_accuracy):
+            stopped.append(s)
+            return True
+        return False
+
+    start = time.time()
+    weights = hg.initialize_weights(uni, shared['constraints'])
+    sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+    final_result = hg.adjust_weights(iterations, data, shared['grammar'], weights, rate, sum_of_relative_frequencies, 1,
+                                     monitor if shared['margin'] < 1 else None)
+    board.post(final_result[4], final_result[0])
+    return (final_result, time.time() - start, len(stopped) > 0)
+
+# The base seed of a run: the one saved in its checkpoint when it is resumed, otherwise the given one (or a random one),
+# which is saved in the checkpoint
+def resume_seed(checkpoint, seed):
+    if checkpoint is not None and checkpoint.get('seed') is not None:
+        return (checkpoint.get('seed'))
+    if seed is None:
+        seed = random.randint(1, 1000000)
+    if checkpoint is not None:
+        checkpoint.save('seed', seed)
+    return (seed)
+
+# Runs jobs in a pool of processes like HGpool.run_jobs, skipping the jobs that the checkpoint of the run says are done,
+# and saving each job in the checkpoint as soon as it is done; names are the keys of the jobs in the checkpoint
+# The jobs find the key of the checkpoint in shared['checkpoint'], to save their own progress
+def run_checkpointed_jobs(function, jobs, processes, shared, checkpoint, names):
+    done = checkpoint.get('done', {}) if checkpoint is not None else {}
+    todo = [index for index in range(len(jobs)) if names[index] not in done]
+    if len(done) > 0:
+        print 'Resuming from a checkpoint: %d of %d jobs are already done\n' % (len(jobs) - len(todo), len(jobs))
+    shared['checkpoint'] = checkpoint.key if checkpoint is not None else None
+
+    def job_done(index, result):
+        done[names[todo[index]]] = result
+        checkpoint.save('done', done)
+
+    results = HGpool.run_jobs(function, [jobs[index] for index in todo], processes, shared,
+                              job_done if checkpoint is not None else None)
+    for (index, result) in zip(todo, results):
+        done[names[index]] = result
+    return ([done[name] for name in names])
+
+# Reads a grid of values: a comma-separated list of values and start:stop:step ranges (including stop; step 1 by default)
+def parse_grid(text, kind, default):
+    if text.strip() == '':
+        return (default)
+    values = []
+    for part in text.replace(' ', '').split(','):
+        if ':' in part:
+            bounds = [kind(value) for value in part.split(':')]
+            (start, stop, step) = bounds if len(bounds) == 3 else (bounds[0], bounds[1], 1)
+            n = int(round((stop - start) / float(step)))
+            values.extend([kind(round(start + j * step, 10)) for j in range(n + 1)])
+        else:
+            values.append(kind(part))
+    return (values)
+
 ## Runs the GLA removing one constraint each time, to find the maximum success with each subset of constraints
-def minusone(eval_files_dir, iterations, rate, uni):
+## The violations are read once; the ablations are independent and run in a pool of processes (processes=None uses
+## every core), each seeded from the base seed and its constraint so that a run can be reproduced
+def minusone(eval_files_dir, iterations, rate, uni, processes = None, seed = None):
     eval_files_letters = hg.get_eval_files(eval_files_dir)
     filenames = eval_files_letters[0]
 
@@ -132,39 +468,35 @@ def minusone(eval_files_dir, iterations, rate, uni):
     logf.write('%s\n' % (ID))
 
     all_constraints = get_constraints(0)
-    suppress = 1
-
-    max_acc_without = {}
 
-    # Get violations without one constraint each time
-    for const in all_constraints:
-        logf.write('\n\n')
-        constraints = [c for c in all_constraints if c != const]
-        print 'Analyzing constraint violations without constraint number %s\n' % (const)
-        logf.write('Results without constraint %s\n' % (const))
-        grammar = {}
-        for eval_filename in filenames:
-            grammar = hg.write_letter(eval_filename, constraints, grammar)
-        print 'All done with constraint violations!\n'
-
-        # Initialize weights
-        weights = hg.initialize_weights(uni, constraints)
-
-        sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
-
-        # Evaluate the data and adjust the weights for n iterations
-        final_result = hg.adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_frequencies, suppress)
+    # Get the violations of all the constraints once
+    print 'Analyzing constraint violations...'
+    grammar = hg.get_grammar(filenames, all_constraints)
+    print 'All done with constraint violations!\n'
 
-        full_success = hg.write_summary(final_result, constraints, logf)
-        failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf,
-                                          full_success)  # failed_letters = (letter, target, failures)
+    checkpoint = HGcheckpoint.open_run('minusone', filenames, [targets_filename], all_constraints, iterations, rate, uni, seed,
+                                       hg.no_neg, hg.sampling, hg.batch_size)
+    seed = resume_seed(checkpoint, seed)
+    print 'Running %d ablations (base seed %d)...\n' % (len(all_constraints), seed)
+    run_ablations(grammar, all_constraints, data, iterations, rate, uni, seed, logf, processes, checkpoint)
 
-        max_accuracy = final_result[0]
-        max_acc_iter = final_result[1]
-        max_acc_wts = final_result[2]
-        max_acc_s = final_result[4]
+    logf.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+
+# Runs the ablations of the minusone mode (also run by HGbatch), each seeded from the base seed and its constraint, and
+# writes their results and a summary to the log
+# Returns the results without each constraint: {constraint: (max accuracy, iteration, weights, failures, samples)}
+def run_ablations(grammar, all_constraints, data, iterations, rate, uni, seed, logf, processes = None, checkpoint = None):
+    jobs = [(const, HGpool.derive_seed(seed, const)) for const in all_constraints]
+    shared = {'grammar': grammar, 'all_constraints': all_constraints, 'data': data, 'iterations': iterations,
+              'rate': rate, 'uni': uni}
+    results = run_checkpointed_jobs(run_ablation, jobs, processes, shared, checkpoint, all_constraints)
 
-        max_acc_without[const] = (max_accuracy, max_acc_iter, max_acc_wts, failed_letters, max_acc_s)
+    max_acc_without = {}
+    for (const, result, log_text) in results:
+        logf.write(log_text)
+        max_acc_without[const] = result
 
     logf.write('\n\nSummary\nConstraint\tMax Accuracy\tIterations\tTotal Samples\tFailed Letters\n')
     print '\n\nSummary\nConstraint\tMax Accuracy\tIterations\tTotal Samples\tFailed Letters\n'
@@ -172,17 +504,62 @@ def minusone(eval_files_dir, iterations, rate, uni):
         text = '%s\t%.2f\t%d\t%d\t%s\n' % (const, max_acc_without[const][0], max_acc_without[const][1], max_acc_without[const][4],', '.join(failure[0] for failure in max_acc_without[const][3]))
         logf.write(text)
         print text
+    return (max_acc_without)
+
+# Runs the GLA without one constraint (one job of minusone), returning its results and its part of the log
+def run_ablation(job):
+    (const, seed) = job
+    shared = HGpool.shared
+    HGpool.seed_job(seed)
+    all_constraints = shared['all_constraints']
+    data = shared['data']
+    suppress = 1
 
-    logf.close()
+    # Get violations without the constraint, as a column selection of the full violations
+    logf = StringIO.StringIO()
+    logf.write('\n\n')
+    constraints = [c for c in all_constraints if c != const]
+    columns = [i for i in range(len(all_constraints)) if all_constraints[i] != const]
+    print 'Analyzing constraint violations without constraint number %s\n' % (const)
+    logf.write('Results without constraint %s\n' % (const))
+    grammar = dict((letter, tableau.select(columns)) for (letter, tableau) in shared['grammar'].items())
+
+    # Initialize weights
+    weights = hg.initialize_weights(shared['uni'], constraints)
+
+    sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+
+    # Evaluate the data and adjust the weights for n iterations
+    checkpoint = HGcheckpoint.open_checkpoint(shared.get('checkpoint'), const)
+    final_result = hg.adjust_weights(shared['iterations'], data, hg.prune_grammar(grammar, data), weights, shared['rate'], sum_of_relative_frequencies, suppress,
+                                     checkpoint = checkpoint)
+    if checkpoint is not None:
+        checkpoint.remove()
+
+    full_success = hg.write_summary(final_result, constraints, logf)
+    failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf,
+                                      full_success)  # failed_letters = (letter, target, failures)
+
+    max_accuracy = final_result[0]
+    max_acc_iter = final_result[1]
+    max_acc_wts = final_result[2]
+    max_acc_s = final_result[4]
+
+    return (const, (max_accuracy, max_acc_iter, max_acc_wts, failed_letters, max_acc_s), logf.getvalue())
 
 # Runs the GLA with the same parameters on each of the participant files in a given directory
-def run_all_hg(eval_files_dir, iterations, rate, uni):
+# Participants are independent and run in a pool of processes (processes=None uses every core), each seeded from
+# the base seed and its ID; their parts of the all_HGlog file are merged in sorted order
+def run_all_hg(eval_files_dir, iterations, rate, uni, processes = None, seed = None):
     constraints = get_constraints(0)
     grammar = get_constraint_violations(eval_files_dir, constraints)
+    eval_filenames = [os.path.abspath(filename) for filename in hg.get_eval_files(eval_files_dir)[0]]
 
     ## Run the algorithm for each participant in a given folder
     target_dir = raw_input('Enter the directory with target files: ')
     target_files = get_target_files(target_dir)
+    checkpoint = HGcheckpoint.open_run('all', eval_filenames, [target_files[p] for p in sorted(target_files.keys())], constraints,
+                                       iterations, rate, uni, seed, hg.no_neg, hg.sampling, hg.batch_size)
 
     now = datetime.datetime.now()
     counter = 1
@@ -192,64 +569,18 @@ def run_all_hg(eval_files_dir, iterations, rate, uni):
         log_all_filename = 'all_HGlog_%d-%d-%d_%d.txt' % (now.year, now.month, now.day, counter)
     log_all = open(log_all_filename, 'w')
 
-    all_results = {}
-
-    for participant in sorted(target_files.keys()):
-        data = hg.get_data(target_files[participant])
-        print 'Found %d targets...\n' % (len(data))
-
-        # Open a log file
-        log_filename = 'HGlog_%s_%d-%d-%d.txt' % (participant, now.year, now.month, now.day)
-        logf = open(log_filename, 'w')
-
-        p_accuracy = 0
-        n = 1
-        while p_accuracy < 1 and n <= 3:
-            logf.write('Participant:\t%sAttempt:\t%d\n' % (participant, n))
-
-            # Initialize weights
-            weights = hg.initialize_weights(uni, constraints)
-
-            sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
-
-            # Evaluate the data and adjust the weights for n iterations
-            print 'Looking for optimal weights for participant %s...' % (participant)
-            final_result = hg.adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_frequencies, 0)
-
-            max_accuracy = final_result[0]
-            max_acc_iter = final_result[1]
-            max_acc_wts = final_result[2]
-            initial_grammar = final_result[3]
-            max_acc_s = final_result[4]
-            total_s = final_result[5]
-            rand_seed = final_result[6]
-
-            # Print a summary of the maximum accuracy and the weights associated with it
-            summary_text = '\nMax accuracy reached: %.2f\nMax accuracy first reached on iteration: %d (%d samples)\nRandom number generator initialized with seed %d\nInitial grammar weights:\t%s\nGrammar for max accuracy:\t%s\nConstraints:\t%s' \
-                           % (max_accuracy, max_acc_iter, max_acc_s, rand_seed,
-                              '\t'.join(map(str, [round(wt, 2) for wt in initial_grammar])),
-                              '\t'.join(map(str, [round(wt, 2) for wt in max_acc_wts])), '\t'.join(map(str, constraints)))
-            log_all.write('Participant:\t%s\tAttempt:\t%d' % (participant, n))
-            log_all.write('%s' % summary_text)
-            logf.write(summary_text)
-            print summary_text
-
-            failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf, max_accuracy)  # failed_letters = (letter, target, failures)
-            if max_accuracy == 1:
-                log_all.write('\n\n')
-            else:
-                log_all.write('\nLetter\tTarget\tCandidates ranked higher than (or tied with) the target\n')
-                for failure in failed_letters:
-                    text = "%s\t%s\t%s\n" % (failure[0], failure[1], '\t'.join(failure[2]))
-                log_all.write("%s\n\n" % (text))
-
-            if max_accuracy > p_accuracy:
-                p_accuracy = max_accuracy
-                all_results[participant] = (max_accuracy, max_acc_iter, total_s, failed_letters, rand_seed)
-
-            n += 1
+    seed = resume_seed(checkpoint, seed)
+    print 'Running %d participants (base seed %d)...\n' % (len(target_files), seed)
+    jobs = [(participant, target_files[participant], HGpool.derive_seed(seed, participant))
+            for participant in sorted(target_files.keys())]
+    shared = {'grammar': grammar, 'constraints': constraints, 'iterations': iterations, 'rate': rate, 'uni': uni}
+    results = run_checkpointed_jobs(run_participant, jobs, processes, shared, checkpoint, sorted(target_files.keys()))
 
-        logf.close()
+    all_results = {}
+    for (participant, result, log_all_text) in results:
+        log_all.write(log_all_text)
+        if result is not None:
+            all_results[participant] = result
 
     text = "Participant\tMax Accuracy\tIteration for Max\tTotal Samples\tRandom Seed\tFailed Letters\n"
     print text
@@ -260,8 +591,173 @@ def run_all_hg(eval_files_dir, iterations, rate, uni):
         log_all.write('%s\n' % (text))
     log_all.close()
 
+    # How well the grammar of each participant explains the targets of the others
+    participants = sorted(all_results.keys())
+    cross_log = write_cross_log(grammar, participants, [hg.get_data(target_files[p]) for p in participants],
+                                [all_results[p][5] for p in participants])
+    print 'Cross-participant accuracies written to %s' % (cross_log)
+    if checkpoint is not None:
+        checkpoint.remove()
+
     return ("Great success")
 
+# Runs the GLA for one participant (one job of run_all_hg), with up to 3 attempts
+# Writes the participant's HGlog file and returns its best result and its part of the all_HGlog file
+def run_participant(job):
+    (participant, target_file, seed) = job
+    shared = HGpool.shared
+    HGpool.seed_job(seed)
+    grammar = shared['grammar']
+    constraints = shared['constraints']
+    now = datetime.datetime.now()
+    log_all = StringIO.StringIO()
+    result = None
+
+    data = hg.get_data(target_file)
+    print 'Found %d targets...\n' % (len(data))
+    learning_grammar = hg.prune_grammar(grammar, data)
+
+    # Open a log file, or go back to the last finished attempt of a checkpoint of this participant
+    log_filename = 'HGlog_%s_%d-%d-%d.txt' % (participant, now.year, now.month, now.day)
+    checkpoint = HGcheckpoint.open_checkpoint(shared.get('checkpoint'), participant)
+    saved = checkpoint.get('attempt') if checkpoint is not None else None
+    if saved is None:
+        logf = open(log_filename, 'w')
+    else:
+        (n, p_accuracy, result, log_filename, log_size, log_all_text, random_state, np_random_state) = saved
+        logf = open(log_filename, 'r+')
+        logf.truncate(log_size)
+        logf.seek(log_size)
+        log_all.write(log_all_text)
+        random.setstate(random_state)
+        np.random.set_state(np_random_state)
+    HGmetrics.start()
+
+    if saved is None:
+        p_accuracy = 0
+        n = 1
+    while p_accuracy < 1 and n <= 3:
+        logf.write('Participant:\t%sAttempt:\t%d\n' % (participant, n))
+
+        # Initialize weights
+        weights = hg.initialize_weights(shared['uni'], constraints)
+
+        sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+
+        # Evaluate the data and adjust the weights for n iterations
+        print 'Looking for optimal weights for participant %s...' % (participant)
+        trace = HGlogger.open_trace(log_filename, constraints, '_%d' % (n))
+        final_result = hg.adjust_weights(shared['iterations'], data, learning_grammar, weights, shared['rate'], sum_of_relative_frequencies, 0, trace = trace,
+                                         checkpoint = checkpoint)
+        HGlogger.close_trace(trace)
+
+        max_accuracy = final_result[0]
+        max_acc_iter = final_result[1]
+        max_acc_wts = final_result[2]
+        initial_grammar = final_result[3]
+        max_acc_s = final_result[4]
+        total_s = final_result[5]
+        rand_seed = final_result[6]
+
+        # Print a summary of the maximum accuracy and the weights associated with it
+        summary_text = '\nMax accuracy reached: %.2f\nMax accuracy first reached on iteration: %d (%d samples)\nRandom number generator initialized with seed %d\nInitial grammar weights:\t%s\nGrammar for max accuracy:\t%s\nConstraints:\t%s' \
+                       % (max_accuracy, max_acc_iter, max_acc_s, rand_seed,
+                          '\t'.join(map(str, [round(wt, 2) for wt in initial_grammar])),
+                          '\t'.join(map(str, [round(wt, 2) for wt in max_acc_wts])), '\t'.join(map(str, constraints)))
+        log_all.write('Participant:\t%s\tAttempt:\t%d' % (participant, n))
+        log_all.write('%s' % summary_text)
+        logf.write(summary_text)
+        print summary_text
+
+        failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf, max_accuracy)  # failed_letters = (letter, target, failures)
+        if max_accuracy == 1:
+            log_all.write('\n\n')
+        else:
+            log_all.write('\nLetter\tTarget\tCandidates ranked higher than (or tied with) the target\n')
+            for failure in failed_letters:
+                text = "%s\t%s\t%s\n" % (failure[0], failure[1], '\t'.join(failure[2]))
+            log_all.write("%s\n\n" % (text))
+
+        if max_accuracy > p_accuracy:
+            p_accuracy = max_accuracy
+            result = (max_accuracy, max_acc_iter, total_s, failed_letters, rand_seed, max_acc_wts)
+
+        n += 1
+        # The next attempt starts from here (the finished learner is forgotten first)
+        if checkpoint is not None:
+            logf.flush()
+            checkpoint.save('learner', None)
+            checkpoint.save('attempt', (n, p_accuracy, result, log_filename, logf.tell(), log_all.getvalue(),
+                                        random.getstate(), np.random.get_state()))
+
+    logf.close()
+    if checkpoint is not None:
+        checkpoint.remove()
+    HGmetrics.finish(log_filename, {'participant': participant, 'attempts': n - 1, 'max_accuracy': p_accuracy})
+    return (participant, result, log_all.getvalue())
+
+## Evaluates the best grammar of each participant of an all_HGlog file on the targets of every participant (from the
+## participants' target files), and logs the matrix of accuracies and the letters each grammar fails for each participant
+## The weights in all_HGlog files are rounded to 2 decimals, so the accuracies can differ a little from the runs
+def cross_participants(eval_files_dir):
+    log_all_filename = raw_input('Enter the name of the all_HGlog file: ')
+    (constraints, best_weights) = read_all_hglog(log_all_filename)
+    # The grammar is read first, since get_target_files changes to the target directory (as in run_all_hg)
+    grammar = get_constraint_violations(eval_files_dir, constraints)
+    target_dir = raw_input('Enter the directory with target files: ')
+    target_files = get_target_files(target_dir)
+
+    participants = sorted(p for p in best_weights if p in target_files)
+    missing = sorted(set(best_weights.keys()) ^ set(target_files.keys()))
+    if len(missing) > 0:
+        print 'Skipping the participants without both a grammar and a target file: %s' % (', '.join(missing))
+    cross_log = write_cross_log(grammar, participants, [hg.get_data(target_files[p]) for p in participants],
+                                [best_weights[p] for p in participants])
+    print 'Cross-participant accuracies written to %s' % (cross_log)
+    return(cross_log)
+
+# Reads the constraints and the best grammar of each participant (of all its attempts) from an all_HGlog file
+def read_all_hglog(log_all_filename):
+    if log_all_filename[-4:] != '.txt':
+        log_all_filename = log_all_filename + '.txt'
+    f = open(log_all_filename, 'rU')
+    constraints = None
+    best = {}
+    participant = None
+    for line in f:
+        fields = line.rstrip('\n').split('\t')
+        if fields[0] == 'Participant:':
+            participant = fields[1]
+        elif fields[0].startswith('Max accuracy reached:'):
+            accuracy = float(fields[0].split(':')[1])
+        elif fields[0] == 'Grammar for max accuracy:' and participant is not None:
+            if participant not in best or accuracy > best[participant][0]:
+                best[participant] = (accuracy, [float(wt) for wt in fields[1:]])
+        elif fields[0] == 'Constraints:':
+            if constraints is not None and constraints != [int(c) for c in fields[1:]]:
+                exit('%s: the participants were not all run with the same constraints' % (log_all_filename))
+            constraints = [int(c) for c in fields[1:]]
+    f.close()
+    return (constraints, dict((p, weights) for (p, (accuracy, weights)) in best.items()))
+
+# Writes the accuracy of the grammar of each participant on the targets of every participant, and the letters that
+# each grammar fails for each participant, to a new all_HGcross log; returns its name
+def write_cross_log(grammar, participants, participant_data, weights):
+    (letters, accuracies, failures) = hg.cross_evaluate(grammar, participant_data, weights)
+    now = datetime.datetime.now()
+    logf = hg.open_new_file('all_HGcross_%d-%d-%d_%%d.txt' % (now.year, now.month, now.day))
+    logf.write('Accuracy of the grammar of each participant (rows) on the targets of each participant (columns)\n')
+    logf.write('Grammar\t%s\n' % ('\t'.join(participants)))
+    for (p, row) in zip(participants, accuracies.tolist()):
+        logf.write('%s\t%s\n' % (p, '\t'.join('%.2f' % (accuracy) for accuracy in row)))
+    logf.write('\nGrammar\tTargets\tAccuracy\tFailed Letters\n')
+    for (i, p) in enumerate(participants):
+        for (j, q) in enumerate(participants):
+            failed = [letter for (letter, failed) in zip(letters, failures[i, j].tolist()) if failed]
+            logf.write('%s\t%s\t%.2f\t%s\n' % (p, q, accuracies[i, j], ','.join(failed)))
+    logf.close()
+    return (logf.name)
+
 # Prints a file containing the number of candidates for each letter
 def count_cands(eval_files_dir):
     constraints_filename = 'AllConst'
@@ -270,24 +766,24 @@ def count_cands(eval_files_dir):
     grammar = get_constraint_violations(eval_files_dir, constraints)
 
     data = hg.get_data(targets_filename)
+    write_cand_counts(grammar, data)
 
+    return 'success'
+
+# Writes the number of targets and candidates of each letter of the targets to a new Log_CandCounts file (the countcands
+# mode, also run by HGbatch); returns the numbers of candidates and the name of the log
+def write_cand_counts(grammar, data):
     now = datetime.datetime.now()
-    counter = 1
-    log_filename = 'Log_CandCounts_%d-%d-%d_%d.txt' % (now.year, now.month, now.day, counter)
-    while os.path.isfile(log_filename):
-        counter += 1
-        log_filename = 'Log_CandCounts_%d-%d-%d_%d.txt' % (now.year, now.month, now.day, counter)
-    logf = open(log_filename, 'w')
+    logf = hg.open_new_file('Log_CandCounts_%d-%d-%d_%%d.txt' % (now.year, now.month, now.day))
 
-    for datum in data:
+    n_cands = hg.pack(grammar, data).n_cands.tolist()
+    for (datum, n) in zip(data, n_cands):
         letter = datum[0]
         n_targets = datum[2]
-        cands = grammar[letter]
-        logf.write('%s\t%d\t%d\n' % (letter, n_targets, len(cands)))
-        print letter, n_targets, len(cands)
-
-
-    return 'success'
+        logf.write('%s\t%d\t%d\n' % (letter, n_targets, n))
+        print letter, n_targets, n
+    logf.close()
+    return (n_cands, logf.name)
 
 # Finds the ID of a target file
 def determine_id(targets_filename):
@@ -349,9 +845,7 @@ def get_constraint_violations(eval_files_dir, constraints):
 
     # Get violations
     print 'Analyzing constraint violations...'
-    grammar = {}
-    for eval_filename in filenames:
-        grammar = hg.write_letter(eval_filename, constraints, grammar)
+    grammar = hg.get_grammar(filenames, constraints)
     print 'All done with constraint violations!\n'
     return(grammar)
 
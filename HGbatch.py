@@ -0,0 +1,295 @@
+# Runs a batch of learning jobs without any prompts, from a manifest file
+# Usage: python HGbatch.py <manifest> [<processes> [<retries> [<base seed>]]]
+#
+# The manifest is a tab-separated file with a header line naming its columns, and one job per line
+# (blank lines and lines starting with # are skipped):
+# mode - hg, restarts, lp, minusone, countcands or search (see HG_all1)
+# eval - the folder or zip archive with the Eval files (default: the current directory)
+# constraints - the constraints file (all the constraints of the ablations for minusone, or of the search; default AllConst)
+# targets - the targets file
+# iterations, rate, uni - as in HG_all1 (default 1000, 0.1 and 0)
+# seed - the seed of the job (default: derived from the base seed and the job's number)
+# restarts - the number of restarts for the restarts mode (default 100)
+# no_neg - 1 to constrain the weights to be non-negative in the lp mode (default: HGlearn12.no_neg)
+# max_size - for search, also try every set of up to this many constraints (default 0, i.e. none)
+# Only the columns that differ from the defaults are needed, e.g.
+# mode	constraints	targets	seed
+# hg	MinConstEng	trgEng	1
+# lp	MinConstEng	trgEng
+#
+# The jobs run in a pool of processes (processes=0 uses every core); a job that raises an error is run again with
+# the same seed up to <retries> more times. Each job writes its usual log file in the current directory, and every
+# finished job adds a line to the results table HGbatch_<manifest>_<date>_<n>.txt
+
+import sys
+import os
+import random
+import datetime
+import time
+import traceback
+import StringIO
+import HGlearn12 as hg
+import HGtableau
+import HGpool
+import HGmetrics
+import HGlogger
+import HG_all1
+
+modes = ['hg', 'restarts', 'lp', 'minusone', 'countcands', 'search']
+columns = ['mode', 'eval', 'constraints', 'targets', 'iterations', 'rate', 'uni', 'seed', 'restarts', 'no_neg', 'max_size']
+defaults = {'eval': '.', 'constraints': 'AllConst', 'iterations': '1000', 'rate': '0.1', 'uni': '0', 'seed': '',
+            'restarts': '100', 'no_neg': '', 'max_size': '0'}
+table_header = ['Job', 'Mode', 'Targets', 'Constraints', 'Seed', 'Status', 'Attempts', 'Seconds', 'Max Accuracy',
+                'Iteration for Max', 'Samples for Max', 'Log', 'Details']
+
+# The grammars read by this process, by Eval source and constraints file (reused by later jobs of the same worker)
+grammars = {}
+# The null device read as the standard input of the jobs, opened once per process
+devnull = None
+
+#######################################
+
+## The main function: read the manifest, run its jobs and write the results table
+def main(manifest_filename, processes = None, retries = 1, seed = None):
+    jobs = read_manifest(manifest_filename)
+    problems = check_jobs(jobs)
+    if len(problems) > 0:
+        exit('Found %d problems in %s:\n%s' % (len(problems), manifest_filename, '\n'.join(problems)))
+
+    if seed is None:
+        seed = random.randint(1, 1000000)
+    for job in jobs:
+        if job['seed'] == '':
+            job['seed'] = str(HGpool.derive_seed(seed, job['job']))
+        job['retries'] = retries
+
+    now = datetime.datetime.now()
+    manifest_name = os.path.splitext(os.path.basename(manifest_filename))[0]
+    table = hg.open_new_file('HGbatch_%s_%d-%d-%d_%%d.txt' % (manifest_name, now.year, now.month, now.day))
+    table.write('\t'.join(table_header) + '\n')
+    table.flush()
+    print 'Running %d jobs (base seed %d), writing the results to %s\n' % (len(jobs), seed, table.name)
+
+    # Add each job to the table as soon as it is done, so that a long batch can be followed (or salvaged)
+    def job_done(index, row):
+        table.write('\t'.join(row) + '\n')
+        table.flush()
+        print 'Job %s (%s, %s): %s in %s s, max accuracy %s' % (row[0], row[1], row[2], row[5], row[7], row[8])
+
+    start = time.time()
+    rows = HGpool.run_jobs(run_job, jobs, processes, None, job_done)
+    table.close()
+
+    failed = [row for row in rows if row[5] != 'ok']
+    print '\nFinished %d jobs in %.1f s (%d failed)' % (len(rows), time.time() - start, len(failed))
+    for row in failed:
+        print 'Job %s failed: %s' % (row[0], row[-1])
+    return (rows)
+
+# Read the jobs of a manifest file: a dict of column values for each job, numbered by their line in the file
+def read_manifest(manifest_filename):
+    manifest = open(manifest_filename, 'rU')
+    lines = [(n + 1, line.rstrip('\n')) for (n, line) in enumerate(manifest.readlines())
+             if line.strip() != '' and not line.lstrip().startswith('#')]
+    manifest.close()
+    if len(lines) == 0:
+        exit('%s has no header line' % (manifest_filename))
+    header = [column.strip().lower() for column in lines[0][1].split('\t')]
+    unknown = [column for column in header if column not in columns]
+    if len(unknown) > 0 or 'mode' not in header:
+        exit('%s: the header must name a mode column and only the columns %s (found %s)'
+             % (manifest_filename, ', '.join(columns), ', '.join(header)))
+
+    jobs = []
+    for (n, line) in lines[1:]:
+        values = [value.strip() for value in line.split('\t')]
+        job = dict(defaults)
+        job.update((column, value) for (column, value) in zip(header, values) if value != '')
+        job['job'] = n
+        job['mode'] = job['mode'].lower()
+        jobs.append(job)
+    return (jobs)
+
+# Check every job before starting, so that a typo does not stop a batch halfway through the night
+def check_jobs(jobs):
+    problems = []
+    for job in jobs:
+        where = 'line %d' % (job['job'])
+        if job['mode'] not in modes:
+            problems.append('%s: unknown mode %s (use one of %s)' % (where, job['mode'], ', '.join(modes)))
+        if 'targets' not in job:
+            problems.append('%s: no targets file' % (where))
+        elif not os.path.isfile(txt_filename(job['targets'])):
+            problems.append('%s: targets file %s not found' % (where, job['targets']))
+        if not os.path.isfile(txt_filename(job['constraints'])):
+            problems.append('%s: constraints file %s not found' % (where, job['constraints']))
+        if len(HGtableau.list_eval_files(job['eval'])) == 0:
+            problems.append('%s: no Eval files in %s' % (where, job['eval']))
+        for (column, kind) in [('iterations', int), ('rate', float), ('uni', int), ('seed', int), ('restarts', int),
+                               ('no_neg', int), ('max_size', int)]:
+            try:
+                if job[column] != '':
+                    kind(job[column])
+            except ValueError:
+                problems.append('%s: %s should be a number, not %s' % (where, column, job[column]))
+    return (problems)
+
+# Add the .txt extension the way HGlearn12 does when reading targets and constraints
+def txt_filename(filename):
+    if filename[-3:] != 'txt':
+        filename = filename + '.txt'
+    return (filename)
+
+# Run one job (in a worker process) with its retries, and return its line of the results table
+# Prompts are turned off: a missing file raises an error instead of waiting for an answer that will never come
+# The output of the job is dropped, so the learner does not print its failures either
+def run_job(job):
+    global devnull
+    hg.interactive = 0
+    hg.verbose = 0
+    if devnull is None:
+        devnull = open(os.devnull)
+    sys.stdin = devnull
+    start = time.time()
+    attempt = 0
+    while True:
+        attempt += 1
+        HGpool.seed_job(int(job['seed']))
+        stdout = sys.stdout
+        sys.stdout = StringIO.StringIO()
+        try:
+            result = job_functions[job['mode']](job)
+            status = 'ok'
+        except (Exception, SystemExit):
+            error = traceback.format_exc().strip().splitlines()[-1]
+            result = {'details': error}
+            status = 'failed'
+        finally:
+            sys.stdout = stdout
+        if status == 'ok' or attempt > job['retries']:
+            break
+
+    row = [job['job'], job['mode'], job['targets'], job['constraints'], job['seed'], status, attempt,
+           '%.1f' % (time.time() - start)]
+    row.extend([result.get(column, '') for column in ['accuracy', 'iteration', 'samples', 'log', 'details']])
+    return ([str(value) for value in row])
+
+# Get the constraints and the grammar of a job, reading the Eval files only once per worker
+def get_job_grammar(job):
+    constraints = hg.get_constraints(job['constraints'])
+    key = (os.path.abspath(job['eval']), tuple(constraints))
+    if key not in grammars:
+        grammars[key] = hg.get_grammar(HGtableau.list_eval_files(job['eval']), constraints)
+    return (constraints, grammars[key])
+
+# The values of a result of adjust_weights for the results table
+def result_columns(final_result, failed_letters):
+    return {'accuracy': '%.2f' % (final_result[0]), 'iteration': final_result[1], 'samples': final_result[4],
+            'details': ','.join(sorted(set(failure[0] for failure in failed_letters)))}
+
+####################
+
+## The jobs of each mode: the functions of the modes of HG_all1, with their answers taken from the manifest
+
+# hg: learn the weights with the GLA
+def batch_hg(job):
+    (constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    logf = hg.create_log_file(job['targets'], 0)
+    HGmetrics.start()
+    weights = hg.initialize_weights(int(job['uni']), constraints)
+    sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+    trace = HGlogger.open_trace(logf.name, constraints)
+    final_result = hg.adjust_weights(int(job['iterations']), data, hg.prune_grammar(grammar, data), weights,
+                                     float(job['rate']), sum_of_relative_frequencies, 1, trace = trace)
+    HGlogger.close_trace(trace)
+    full_success = hg.write_summary(final_result, constraints, logf)
+    failed_letters = hg.find_failures(grammar, data, constraints, final_result, logf, full_success)
+    logf.close()
+    HGmetrics.finish(logf.name, {'job': job['job'], 'max_accuracy': final_result[0], 'iteration_for_max': final_result[1],
+                                 'samples_for_max': final_result[4], 'total_samples': final_result[5]})
+    result = result_columns(final_result, failed_letters)
+    result['log'] = logf.name
+    return (result)
+
+# restarts: learn from many random restarts in lockstep and keep the best one
+def batch_restarts(job):
+    (constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    logf = hg.create_log_file(job['targets'], 0)
+    n_restarts = int(job['restarts'])
+    (results, best, failed_letters) = HG_all1.run_restarts(grammar, constraints, data, int(job['iterations']),
+                                                           float(job['rate']), int(job['uni']), n_restarts, logf)
+    logf.close()
+    accuracies = [r[0] for r in results]
+    result = result_columns(results[best], failed_letters)
+    result['log'] = logf.name
+    result['details'] = 'best restart %d of %d (%d with max accuracy 1)%s' \
+                        % (best + 1, n_restarts, accuracies.count(1.0),
+                           '; failed letters ' + result['details'] if result['details'] != '' else '')
+    return (result)
+
+# lp: solve for the weights exactly, or find the rankings that no weights can satisfy together
+def batch_lp(job):
+    (constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    no_neg = hg.no_neg if job['no_neg'] == '' else int(job['no_neg'])
+    logf = hg.create_log_file(job['targets'], 0)
+    (final_result, violated, failed_letters) = HG_all1.solve_linear_program(grammar, constraints, data, no_neg, logf)
+    logf.close()
+    if final_result is None:
+        return {'log': logf.name, 'details': 'infeasible: %d rankings cannot hold together (%s)'
+                                             % (len(violated), ','.join(sorted(set(p[0] for p in violated))))}
+    result = result_columns(final_result, failed_letters)
+    result.update({'iteration': '', 'samples': '', 'log': logf.name})
+    return (result)
+
+# minusone: learn once without each of the constraints (the ablations of one job run one after the other)
+def batch_minusone(job):
+    (all_constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    ID = HG_all1.determine_id(job['targets'])
+    now = datetime.datetime.now()
+    logf = hg.open_new_file('HGlog_MinusOne_%d-%d-%d_%s_%%d.txt' % (now.year, now.month, now.day, ID))
+    logf.write('%s\n' % (ID))
+    max_acc_without = HG_all1.run_ablations(grammar, all_constraints, data, int(job['iterations']), float(job['rate']),
+                                            int(job['uni']), int(job['seed']), logf, 1)
+    logf.close()
+    return {'log': logf.name, 'details': 'accuracy without each constraint: %s'
+                                         % (','.join('%s:%.2f' % (const, result[0]) for (const, result) in sorted(max_acc_without.items())))}
+
+# countcands: the number of candidates of each letter of the targets
+def batch_countcands(job):
+    (constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    (n_cands, log_filename) = HG_all1.write_cand_counts(grammar, data)
+    return {'log': log_filename, 'details': '%d candidates for %d targets' % (sum(n_cands), len(data))}
+
+# search: the smallest sets of the constraints that are enough for every target to win
+def batch_search(job):
+    (constraints, grammar) = get_job_grammar(job)
+    data = hg.get_data(job['targets'])
+    max_size = int(job['max_size'])
+    (searcher, smallest, minimal, log_filename) = HG_all1.run_search(grammar, constraints, data, job['targets'],
+                                                                     int(job['iterations']), float(job['rate']),
+                                                                     int(job['uni']), max_size, int(job['seed']))
+    if smallest is None:
+        return {'log': log_filename, 'details': 'no weights of all the constraints make every target win'}
+    return {'log': log_filename, 'details': 'smallest set %s (%d sets tested, %d pruned)%s'
+                                            % (','.join(map(str, [constraints[c] for c in sorted(smallest)])), len(searcher.tested),
+                                               searcher.n_pruned, '; %d minimal sets of up to %d constraints' % (len(minimal), max_size)
+                                               if max_size > 0 else '')}
+
+job_functions = {'hg': batch_hg, 'restarts': batch_restarts, 'lp': batch_lp, 'minusone': batch_minusone,
+                 'countcands': batch_countcands, 'search': batch_search}
+
+###############################################
+
+### Run the main function
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or len(sys.argv) > 5:
+        exit("usage: HGbatch.py <manifest> [<processes> (0 = every core) [<retries> [<base seed>]]]")
+    processes = int(sys.argv[2]) if len(sys.argv) > 2 and int(sys.argv[2]) > 0 else None
+    retries = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+    seed = int(sys.argv[4]) if len(sys.argv) > 4 else None
+    main(sys.argv[1], processes, retries, seed)
@@ -0,0 +1,197 @@
+# Benchmarks the stages of HGlearn12 on synthetic Eval files, and compares the timings with a stored baseline
+# Usage: python HGbench.py [<sizes> [<baseline file> [save]]]
+# sizes - a comma-separated list of the sizes below (default small,medium)
+# baseline file - a JSON file of timings (default HGbench_baseline.json); with 'save' the timings are stored in it,
+#                 otherwise any stage that is more than `tolerance` slower than its baseline fails the run (exit code 1)
+#
+# The synthetic Eval files have the same format as the MATLAB ones, with a given number of letters, candidates per
+# letter, constraints and sparsity (the share of zero violations). The target of each letter is its best candidate
+# under hidden random weights, so the data can always be learned. The files are generated once into HGbench_data
+# Baselines depend on the machine: save one on the machine where the benchmark is run
+
+import sys
+import os
+import json
+import time
+import random
+import StringIO
+import platform
+import numpy as np
+import HGlearn12 as hg
+import HGtableau
+
+# letters, candidates per letter, constraints, sparsity, seed
+sizes = {'small': (20, 200, 20, 0.7, 1),
+         'medium': (50, 2000, 46, 0.8, 1),
+         'large': (5, 100000, 46, 0.9, 1),
+         'wide': (20, 5000, 200, 0.95, 1)}
+stages = ['write_letter', 'get_grammar', 'optimize', 'evaluate', 'update', 'adjust_weights']
+tolerance = 0.5 # A stage fails when it takes more than (1 + tolerance) times its baseline
+min_seconds = 0.2 # Each timing runs a stage over and over until it took at least this long, and is the time of one run
+repeats = 3 # Each stage is timed this many times and the fastest timing is kept
+data_dir = 'HGbench_data'
+
+#######################################
+
+## The main function: time every stage for each size, then save or check the baseline
+def main(size_names, baseline_filename, save):
+    timings = {}
+    for name in size_names:
+        folder = generate_eval_files(name, *sizes[name])
+        print 'Size %s: %d letters x %d candidates x %d constraints, sparsity %.2f' % ((name,) + sizes[name][:4])
+        timings[name] = time_stages(folder)
+        for stage in stages:
+            print '    %s\t%.4f s' % (stage, timings[name][stage])
+
+    if save:
+        baseline = read_baseline(baseline_filename)
+        baseline['machine'] = platform.node()
+        baseline['python'] = platform.python_version()
+        baseline.setdefault('sizes', {}).update(timings)
+        f = open(baseline_filename, 'w')
+        json.dump(baseline, f, indent = 2, sort_keys = True)
+        f.close()
+        print 'Saved the timings of %s to %s' % (', '.join(size_names), baseline_filename)
+        return (0)
+
+    failures = compare(timings, read_baseline(baseline_filename))
+    if len(failures) > 0:
+        print '\n%d stages are slower than the baseline in %s:' % (len(failures), baseline_filename)
+        for failure in failures:
+            print '    %s %s: %.4f s (baseline %.4f s)' % failure
+        return (1)
+    print '\nNo stage is slower than the baseline in %s' % (baseline_filename)
+    return (0)
+
+# Write a set of synthetic Eval files, a constraints file (every constraint active) and a targets file
+# The files are only written once for a given size; returns their folder
+def generate_eval_files(name, n_letters, n_cands, n_constraints, sparsity, seed):
+    folder = os.path.join(data_dir, '%s_%d_%d_%d_%g_%d' % (name, n_letters, n_cands, n_constraints, sparsity, seed))
+    if os.path.isfile(os.path.join(folder, 'trgBench.txt')):
+        return (folder)
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    rng = np.random.RandomState(seed)
+    hidden_weights = rng.random_sample(n_constraints)
+    targets = []
+    for l in range(n_letters):
+        letter = 'L%d' % (l + 1)
+        zeros = rng.random_sample((n_cands, n_constraints)) < sparsity
+        violations = np.where(zeros, 0, rng.geometric(0.5, (n_cands, n_constraints)))
+        cand_nums = np.arange(1, n_cands + 1)
+        scores = violations.sum(axis = 1)
+        target = int(cand_nums[np.argmax(-np.dot(violations, hidden_weights))])
+        targets.append('Eval-%s-uc\t%d\n' % (letter, target))
+
+        # The candidate code is not used by the learner, so any dotted code will do
+        body = StringIO.StringIO()
+        np.savetxt(body, np.column_stack((scores, cand_nums, violations)), fmt = '%d', delimiter = '\t', newline = '\r\n')
+        lines = body.getvalue().split('\r\n')[:-1]
+        f = open(os.path.join(folder, 'Eval-%s-uc.txt' % (letter)), 'wb')
+        f.write('Total Candidates:\t%d\r\nConstraint Violations\r\n\t\tStratum\t%s\r\nCandCode\tScore\tCandNum\t%s\r\n'
+                % (n_cands, '\t'.join(['1'] * n_constraints), '\t'.join(str(c + 1) for c in range(n_constraints))))
+        f.write(''.join('%02d.%02d\t%s\r\n' % (c // 100 % 100, c % 100, line) for (c, line) in enumerate(lines)))
+        f.close()
+
+    f = open(os.path.join(folder, 'ConstBench.txt'), 'w')
+    f.write(''.join('%d\t1\n' % (c + 1) for c in range(n_constraints)))
+    f.close()
+    f = open(os.path.join(folder, 'trgBench.txt'), 'w')
+    f.write(''.join(targets))
+    f.close()
+    return (folder)
+
+# Time each stage on the Eval files of a folder (the fastest of `repeats` timings), in seconds per run
+# Fast stages (optimize, evaluate, update take well under a millisecond on the small size) are run many times per timing,
+# so that their slowdowns are measured and not lost in the resolution of the clock
+def time_stages(folder):
+    filenames = sorted(HGtableau.list_eval_files(folder))
+    constraints = hg.get_constraints(os.path.join(folder, 'ConstBench.txt'))
+    data = hg.get_data(os.path.join(folder, 'trgBench.txt'))
+    weights = np.random.RandomState(0).random_sample(len(constraints)).tolist()
+    sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+    grammar = hg.get_grammar(filenames, constraints)
+
+    # Parsing every Eval file from scratch, and getting the grammar from the (up to date) compiled cache
+    def write_letters():
+        g = {}
+        for filename in filenames:
+            hg.write_letter(filename, constraints, g)
+
+    def get_grammar():
+        hg.get_grammar(filenames, constraints)
+
+    def optimize():
+        for datum in data:
+            hg.optimize(weights, grammar, datum[0], len(datum[1]))
+
+    def evaluate():
+        hg.evaluate(weights, grammar, data)
+
+    def update():
+        rng = random.Random(1)
+        for datum in data:
+            hg.update(datum, grammar, weights, 0.1, rng)
+
+    # A fixed number of samples from fixed initial weights, on the pruned grammar as in HGlearn12.main
+    def adjust_weights():
+        random.seed(1)
+        hg.adjust_weights(200, data, hg.prune_grammar(grammar, data), list(weights), 0.1, sum_of_relative_frequencies, 1)
+
+    functions = {'write_letter': write_letters, 'get_grammar': get_grammar, 'optimize': optimize,
+                 'evaluate': evaluate, 'update': update, 'adjust_weights': adjust_weights}
+    timings = {}
+    stdout = sys.stdout
+    try:
+        for stage in stages:
+            best = None
+            for r in range(repeats):
+                sys.stdout = StringIO.StringIO()
+                runs = 0
+                start = time.time()
+                while runs == 0 or time.time() - start < min_seconds:
+                    functions[stage]()
+                    runs += 1
+                seconds = (time.time() - start) / runs
+                sys.stdout = stdout
+                best = seconds if best is None else min(best, seconds)
+            timings[stage] = best
+    finally:
+        sys.stdout = stdout
+    return (timings)
+
+# Read a baseline file (empty when there is none yet)
+def read_baseline(baseline_filename):
+    if not os.path.isfile(baseline_filename):
+        return {}
+    f = open(baseline_filename)
+    baseline = json.load(f)
+    f.close()
+    return (baseline)
+
+# The stages that are slower than their baseline: (size, stage, seconds, baseline seconds)
+def compare(timings, baseline):
+    failures = []
+    for name in sorted(timings.keys()):
+        if name not in baseline.get('sizes', {}):
+            print 'No baseline for size %s' % (name)
+            continue
+        for stage in stages:
+            base = baseline['sizes'][name].get(stage)
+            seconds = timings[name][stage]
+            if base is not None and seconds > (1 + tolerance) * base:
+                failures.append((name, stage, seconds, base))
+    return (failures)
+
+###############################################
+
+### Run the main function
+if __name__ == '__main__':
+    if len(sys.argv) > 4 or (len(sys.argv) == 4 and sys.argv[3] != 'save'):
+        exit("usage: HGbench.py [<sizes> (%s; default small,medium) [<baseline file> [save]]]" % (','.join(sorted(sizes.keys()))))
+    size_names = sys.argv[1].split(',') if len(sys.argv) > 1 else ['small', 'medium']
+    unknown = [name for name in size_names if name not in sizes]
+    if len(unknown) > 0:
+        exit('Unknown sizes: %s (use %s)' % (', '.join(unknown), ', '.join(sorted(sizes.keys()))))
+    baseline_filename = sys.argv[2] if len(sys.argv) > 2 else 'HGbench_baseline.json'
+    sys.exit(main(size_names, baseline_filename, len(sys.argv) == 4))
@@ -0,0 +1,98 @@
+# Checkpoints of long runs, so that a run that dies (e.g. preempted on a shared machine) can be resumed where it stopped
+# Set enabled = 1 below (or HGcheckpoint.enabled = 1 from a script) and the hg, all, minusone and sweep modes save their
+# state to compressed files in the `directory` folder:
+# - the learner (adjust_weights) saves its current and best weights, its counters, and the states of the random number
+#   generators every `interval` seconds
+# - the all and minusone modes also save the base seed and every finished participant or ablation, and the sweep mode
+#   every finished configuration (its unfinished ones start over)
+# Running the same mode again with the same Eval files, constraints, targets and settings finds the checkpoint and
+# continues from it, giving exactly the same results as a run that never stopped. The checkpoints of a run are deleted
+# once it is done
+
+import os
+import time
+import zlib
+import hashlib
+import cPickle
+import HGtableau
+
+enabled = 0 # Set to 1 to save checkpoints of the hg, all, minusone and sweep modes and resume from them
+interval = 60 # Seconds between two checkpoints of a learning run
+directory = 'HGcheckpoints' # The folder of the checkpoint files (relative to the current directory)
+
+#######################################
+
+# A key that identifies a run by its inputs: Eval files (by their signatures), targets files (by their contents) and
+# any other settings
+def run_key(kind, eval_filenames, targets_filenames, *settings):
+    digest = hashlib.sha1(kind)
+    for filename in sorted(eval_filenames):
+        digest.update('%s:%r\n' % (filename, HGtableau.file_signature(filename)))
+    for filename in targets_filenames:
+        filename = filename if filename[-3:] == 'txt' else filename + '.txt'
+        f = open(filename, 'rb')
+        digest.update(f.read())
+        f.close()
+    digest.update(repr(settings))
+    return ('%s_%s' % (kind, digest.hexdigest()[:16]))
+
+# Open the checkpoint of a run identified by its inputs (see run_key), or return None when checkpoints are turned off
+def open_run(kind, eval_filenames, targets_filenames, *settings):
+    if not enabled:
+        return None
+    return open_checkpoint(run_key(kind, eval_filenames, targets_filenames, *settings))
+
+# Open the checkpoint of a run (or of one job of a run, with job) from the key of the run, or return None when
+# checkpoints are turned off. The checkpoint holds the saved state of an earlier attempt at the same run, if any
+def open_checkpoint(key, job = None):
+    if not enabled or key is None:
+        return None
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    name = key if job is None else '%s_%s' % (key, job)
+    return Checkpoint(os.path.join(directory, name + '.ckpt'), key)
+
+# The saved state of a run: a dictionary of named values, written to disk as a whole
+class Checkpoint(object):
+    def __init__(self, filename, key = None):
+        self.filename = filename
+        self.key = key
+        self.state = {}
+        if os.path.isfile(filename):
+            f = open(filename, 'rb')
+            self.state = cPickle.loads(zlib.decompress(f.read()))
+            f.close()
+        self.last_save = time.time()
+
+    # A saved value (default when it was never saved)
+    def get(self, name, default = None):
+        return self.state.get(name, default)
+
+    # Whether it is time to save the learner again
+    def due(self):
+        return time.time() - self.last_save >= interval
+
+    # Set a value (none to forget it) and write the whole state; the file is replaced at once, so a crash while
+    # saving leaves the previous checkpoint
+    def save(self, name, value):
+        if value is None:
+            self.state.pop(name, None)
+        else:
+            self.state[name] = value
+        temporary_filename = self.filename + '.tmp'
+        f = open(temporary_filename, 'wb')
+        f.write(zlib.compress(cPickle.dumps(self.state, cPickle.HIGHEST_PROTOCOL)))
+        f.close()
+        if os.name == 'nt' and os.path.exists(self.filename):
+            os.remove(self.filename)
+        os.rename(temporary_filename, self.filename)
+        self.last_save = time.time()
+
+    # Delete the checkpoint once its run is done
+    def remove(self):
+        self.state = {}
+        if os.path.exists(self.filename):
+            os.remove(self.filename)
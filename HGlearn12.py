@@ -6,9 +6,26 @@ import random
 import datetime
 import numpy as np
 import os
-import glob
-import operator
 import re
+import errno
+import bisect
+import HGtableau
+import HGmetrics
+import HGlogger
+import HGcheckpoint
+import HGresults
+
+no_neg = 0 # Set to 1 to prohibit negative weights; set to 0 to allow negative weights
+interactive = 1 # Set to 0 to raise an IOError instead of asking for another file when an input file is not found
+verbose = 1 # Set to 0 to stop update() from printing every failure it finds (no string formatting in the learning loop)
+sampling = 0 # How data points are drawn (see DatumSampler): 0 = one at a time from the random module, as in older
+             # versions; 1 = in batches from a NumPy generator seeded with the run's seed; 2 = like 1, but in epochs,
+             # where every target is drawn once (in a random order) before any is drawn again
+batch_size = None # None = learn from one data point at a time (the GLA); 0 = learn in epochs, moving the weights once
+                  # per epoch by the summed changes of every failing pair (full batch); n > 0 = the same, in mini-batches
+                  # of n data points. In both batch modes iterations is the number of epochs (see adjust_weights_epochs)
+rank_table = None # None = no rank table; 0 = find_failures also writes every target's rank and all of its competitors to
+                  # <log>.ranks.tsv; n > 0 = the same with only the n best competitors of each target (see RankTable)
 
 ##########################
 ## The main function that runs the GLA to find optimal HG weights for a given set of targets and constraint violations
@@ -23,9 +40,7 @@ def main(eval_files_dir, constraints, targets_filename, iterations, rate, uni, o
     ## Get data from user files
     # Get violations
     print 'Analyzing constraint violations...'
-    grammar = {}
-    for eval_filename in filenames:
-        grammar = write_letter(eval_filename, constraints, grammar)
+    grammar = get_grammar(filenames, constraints)
     print 'All done with constraint violations!\n'
 
     # Get targets
@@ -37,16 +52,25 @@ def main(eval_files_dir, constraints, targets_filename, iterations, rate, uni, o
 
     # Open a log file
     logf = create_log_file(targets_filename, override)
+    HGmetrics.start(sys.modules[__name__])
 
     sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+    checkpoint = HGcheckpoint.open_run('hg', filenames, [targets_filename], constraints, iterations, rate, uni, no_neg, sampling, batch_size)
 
     # Evaluate the data and adjust the weights for n iterations
     print 'Looking for optimal weights...'
-    final_result = adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_frequencies, suppress = 0)
+    trace = HGlogger.open_trace(logf.name, constraints)
+    final_result = adjust_weights(iterations, data, prune_grammar(grammar, data), weights, rate, sum_of_relative_frequencies, suppress = 0, trace = trace,
+                                  checkpoint = checkpoint)
+    HGlogger.close_trace(trace)
+    if checkpoint is not None:
+        checkpoint.remove()
 
     full_success = write_summary(final_result, constraints, logf)
     failed_letters = find_failures(grammar, data, constraints, final_result, logf, full_success)
     logf.close()
+    HGmetrics.finish(logf.name, {'max_accuracy': final_result[0], 'iteration_for_max': final_result[1],
+                                 'samples_for_max': final_result[4], 'total_samples': final_result[5]})
 
     return(failed_letters)
 
@@ -80,48 +104,98 @@ def get_data(targets_filename):
     targets_file.close()
     return data
 
-# Compute the harmony based on a given set of weights and violations
-def harmony(violations, weights):
-    harmony = 0.0
-    for i in range(0, len(weights)):
-        harmony -= weights[i] * float(violations[i])
-    return harmony
+# Find the rows of the n_targets highest-harmony candidates, plus any candidates tied with the last of them
+# counts gives the number of candidates each row stands for, for tableaux with merged duplicates
+def select_winners(harmonies, n_targets, counts = None):
+    n_cands = len(harmonies)
+    if n_targets <= 0 or n_cands == 0:
+        return np.array([], dtype=np.intp)
+    if counts is not None:
+        order = np.argsort(-harmonies, kind='mergesort')
+        position = np.searchsorted(np.cumsum(counts[order]), n_targets)
+        if position >= n_cands:
+            winners = np.arange(n_cands)
+        else:
+            winners = np.flatnonzero(harmonies >= harmonies[order[position]])
+    elif n_targets >= n_cands:
+        winners = np.arange(n_cands)
+    else:
+        kth_h = np.partition(harmonies, n_cands - n_targets)[n_cands - n_targets]
+        winners = np.flatnonzero(harmonies >= kth_h)
+    return winners[np.argsort(-harmonies[winners], kind='mergesort')]
 
 # Optimize the weights based on a given input
 def optimize(weights, grammar, pInput, n_targets):
-    h_hash = {}
-    outputs = grammar[pInput].keys()
-    for o in outputs:
-        h_hash[o] = harmony(grammar[pInput][o], weights)
+    tableau = grammar[pInput]
+    h = tableau.harmonies(weights)
+    winners = select_winners(h, n_targets, tableau.counts)
     optimal_output = {}
-    next_h = max(h_hash.values())
-    min_h = -1000
-    while len(optimal_output) < n_targets or next_h == min_h:
-        max_t = max(h_hash.iteritems(), key = operator.itemgetter(1))[0]
-        optimal_output[max_t] = h_hash[max_t]
-        min_h = h_hash[max_t]
-        h_hash[max_t] = -10000
-        next_h = max(h_hash.values())
+    for row, row_h in zip(winners.tolist(), h[winners].tolist()):
+        for cand in tableau.cands_of([row]):
+            optimal_output[cand] = row_h
     return optimal_output
 
-# Choose a random data point to test next
-def next_datum(data, sum_of_relative_frequencies):
-    r = random.randint(1, sum_of_relative_frequencies)
-    datum = (data[0][0], data[0][1])
-    if r > int(data[0][2]):
-        frequency_sum = int(data[0][2])
-        for i in range(1, len(data)):
-            if r <= int(data[i][2]) + frequency_sum:
-                datum = (data[i][0], data[i][1])
-                break
-            else:
-                frequency_sum += int(data[i][2])
-    return datum
+# Draw the positions in data of random data points, proportionally to their numbers of targets
+# The cumulative numbers of targets are computed once, and each draw is a binary search (O(log letters))
+# Without a seed, each draw takes one rng.randint(1, total), as the baseline learner did; with a seed, the draws come in
+# batches from their own NumPy generator (so they do not depend on any other use of random numbers), and with epochs=1
+# every target is drawn once per epoch, in a shuffled order
+class DatumSampler(object):
+    def __init__(self, data, rng = random, seed = None, epochs = 0, batch = 1024):
+        self.counts = [int(datum[2]) for datum in data]
+        self.cumulative = np.cumsum(self.counts)
+        self.cumulative_list = self.cumulative.tolist()
+        self.total = self.cumulative_list[-1] if len(data) > 0 else 0
+        self.rng = rng
+        self.generator = None if seed is None else np.random.RandomState(seed)
+        self.epochs = epochs
+        self.batch = batch
+        self.drawn = []
+        self.position = 0
+        if epochs:
+            self.population = np.repeat(np.arange(len(data)), self.counts)
+
+    # The position of the next data point
+    def next_index(self):
+        if self.generator is None:
+            return bisect.bisect_left(self.cumulative_list, self.rng.randint(1, self.total))
+        if self.position >= len(self.drawn):
+            self.refill()
+        i = self.drawn[self.position]
+        self.position += 1
+        return i
+
+    # The state of the sampler's own generator and batch (None when it draws from rng), to resume it later
+    def get_state(self):
+        if self.generator is None:
+            return None
+        return (self.generator.get_state(), self.drawn, self.position)
+
+    # Resume the sampler from a state given by get_state
+    def set_state(self, state):
+        if state is not None:
+            (generator_state, self.drawn, self.position) = state
+            self.generator.set_state(generator_state)
+
+    # Draw the next batch (or epoch) of positions
+    def refill(self):
+        if self.epochs:
+            self.drawn = self.generator.permutation(self.population).tolist()
+        else:
+            r = self.generator.randint(1, self.total + 1, size = self.batch)
+            self.drawn = np.searchsorted(self.cumulative, r).tolist()
+        self.position = 0
+
+# The sampler of a run, following the sampling setting; seed is the run's seed (for sampling = 1 or 2)
+def make_sampler(data, seed, rng = random):
+    if sampling == 0:
+        return DatumSampler(data, rng)
+    return DatumSampler(data, seed = seed, epochs = 1 if sampling == 2 else 0)
 
 # Compute the change vector to modify the weights
 def compute_change_vector(error, target, rate):
-    error = np.round(map(float, error), 3)
-    target = np.round(map(float, target), 3)
+    error = np.round(np.asarray(error, dtype=float), 3)
+    target = np.round(np.asarray(target, dtype=float), 3)
     v = np.subtract(error, target)
     v = np.multiply(v, rate)
     v = np.round(v, 2)
@@ -129,8 +203,7 @@ def compute_change_vector(error, target, rate):
 
 
 # Check if a given input matches the output
-def update(datum, grammar, weights, rate):
-    no_neg = 0 # Set to 1 to prohibit negative values; set to 0 to allow negative values
+def update(datum, grammar, weights, rate, rng = random):
     pInput = datum[0]
     target = datum[1]
     output = optimize(weights, grammar, pInput, len(target))
@@ -139,50 +212,421 @@ def update(datum, grammar, weights, rate):
         weights = weights
     else:
         fail = []
-        t_h = [harmony(grammar[pInput][t], weights) for t in target]
+        t_h = grammar[pInput].harmonies(weights)[grammar[pInput].rows(target)].tolist()
         for o in output:
             o_h = output[o]
             for t in range(len(target)):
                 if o_h >= t_h[t] and o != target[t]:
                     fail.append((o, target[t]))
-                    print "For letter %s target %s has lower harmony (%s) than candidate %s (%s)" % (pInput, target[t], t_h[t], o, o_h)
+                    if verbose:
+                        print "For letter %s target %s has lower harmony (%s) than candidate %s (%s)" % (pInput, target[t], t_h[t], o, o_h)
         if len(fail) == 0:
-            print "NO FAILURES FOUND"
+            if verbose:
+                print "NO FAILURES FOUND"
             weights = weights
         else:
-            pick_one = random.choice(fail)
+            pick_one = rng.choice(fail)
             change_vector = compute_change_vector(grammar[pInput][pick_one[0]], grammar[pInput][pick_one[1]], rate)
             weights = np.add(weights, change_vector).tolist()
             if no_neg == 1:
                 weights = [max(w, 0) for w in weights]
     return weights
 
-# Evaluate the data on a given set of weights
+# The failing (output, target) pairs of a datum, for all the outputs and targets at once: the rows of the winning outputs,
+# the rows of the targets, and for each pair the number of candidates for which update() would find it failing
+# (an output at least as harmonious as the target that is not the target itself)
+def failing_pairs(datum, grammar, weights):
+    tableau = grammar[datum[0]]
+    h = tableau.harmonies(weights)
+    winners = select_winners(h, len(datum[1]), tableau.counts)
+    target_rows = tableau.rows(datum[1])
+    n_cands = np.ones(len(winners), dtype=int) if tableau.counts is None else tableau.counts[winners]
+    pairs = n_cands[:, np.newaxis] - (winners[:, np.newaxis] == target_rows)
+    pairs[h[winners][:, np.newaxis] < h[target_rows]] = 0
+    return (winners, target_rows, pairs)
+
+# The summed change vectors of all the failing pairs of a datum (the changes update() picks one of at random)
+def batch_change_vector(datum, grammar, weights, rate):
+    (winners, target_rows, pairs) = failing_pairs(datum, grammar, weights)
+    violations = grammar[datum[0]].dense()
+    error = np.round(violations[winners].astype(float), 3)
+    target = np.round(violations[target_rows].astype(float), 3)
+    changes = np.round(np.multiply(error[:, np.newaxis, :] - target[np.newaxis, :, :], rate), 2)
+    return np.tensordot(pairs, changes, axes = 2)
+
+# Shrink the tableaux of the letters in data before learning: candidates with identical violations share one row, and
+# when the weights cannot be negative, non-targets bounded by another non-target are dropped
+# Any set of weights gets the same accuracy on the pruned grammar; find_failures should still get the full grammar
+def prune_grammar(grammar, data, no_neg = None):
+    if no_neg is None:
+        no_neg = globals()['no_neg']
+    targets = {}
+    for (letter, target, n) in data:
+        targets.setdefault(letter, set()).update(target)
+    pruned = dict(grammar)
+    for letter in targets:
+        tableau = grammar[letter].merge_duplicates()
+        if no_neg == 1:
+            tableau = HGtableau.drop_bounded(tableau, tableau.rows(sorted(targets[letter])))
+        pruned[letter] = tableau
+    return pruned
+
+# Evaluate the data on a given set of weights (or on each row of a matrix of weights, giving one accuracy per row)
 def evaluate(weights, grammar, data):
-    correct_count = 0
-    for datum in data:
-        targets = datum[1]
-        output = optimize(weights, grammar, datum[0], len(targets)).keys()
-        if set(output) == set(targets):
-            correct_count += len(targets)
-    accuracy = float(correct_count) / sum(n for (_, _,n) in data)
+    accuracy = pack(grammar, data).accuracy(weights)
     #print 'ACCURACY is\t%s\n' % (str(accuracy))
     return (accuracy)
 
+# The tableaux of the letters of data packed into one contiguous matrix, with the rows of each datum between two
+# offsets, so that the harmonies of every candidate are one matrix product and the decisions of every letter are
+# segmented reductions (np.*.reduceat) over them
+# The packed product may round differently from the product of each tableau alone, so any decision within `tolerance`
+# of a tie (and any datum with duplicate targets, no competitors, or targets merged with a non-target) is checked
+# exactly on its own tableau: the results are always the same as optimizing the letters one by one
+class PackedGrammar(object):
+    def __init__(self, grammar, data, tolerance = 1e-9):
+        self.grammar = grammar
+        self.data = data
+        self.tolerance = tolerance
+        self.tableaux = [grammar[letter] for (letter, _, _) in data]
+        self.n_targets = np.array([n for (_, _, n) in data])
+        self.total = float(self.n_targets.sum())
+        self.n_cands = np.array([len(tableau.keys()) for tableau in self.tableaux])
+        matrices = []
+        is_target = []
+        counts = []
+        self.offsets = [0]
+        self.exact = []
+        for ((letter, target, n), tableau) in zip(data, self.tableaux):
+            matrices.append(tableau.dense())
+            counts.append(np.ones(len(tableau), dtype=int) if tableau.counts is None else tableau.counts)
+            mask = np.zeros(len(tableau), dtype=bool)
+            mask[tableau.rows(target)] = True
+            is_target.append(mask)
+            self.offsets.append(self.offsets[-1] + len(tableau))
+            self.exact.append(needs_exact_check(tableau, target, n))
+        self.violations = np.concatenate(matrices).astype(float)
+        self.max_violation = np.abs(self.violations).max() if self.violations.size else 0.0
+        self.counts = np.concatenate(counts)
+        self.is_target = np.concatenate(is_target)
+        self.starts = np.array(self.offsets[:-1])
+        self.sizes = np.diff(self.offsets)
+        self.letter_of = np.repeat(np.arange(len(data)), self.sizes)
+        self.exact = np.array(self.exact)
+
+    # Whether this packing still stands for the given grammar and data
+    def matches(self, grammar, data):
+        return self.grammar is grammar and self.data == data and \
+               all(grammar.get(letter) is tableau for ((letter, _, _), tableau) in zip(data, self.tableaux))
+
+    # The harmonies of all the packed candidates (candidates, or weight vectors x candidates for a weight matrix)
+    def harmonies(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        return 0.0 - np.dot(weights, self.violations.T) if weights.ndim == 2 else 0.0 - np.dot(self.violations, weights)
+
+    # The largest total change of weights that cannot flip a decision computed in floating point
+    def threshold(self, weights):
+        return self.tolerance * (1.0 + self.max_violation * np.abs(weights).sum(axis = -1))
+
+    # The gap between the worst target and the best non-target of every datum (positive when the datum is correct)
+    def gaps(self, harmonies):
+        axis = harmonies.ndim - 1
+        min_target = np.minimum.reduceat(np.where(self.is_target, harmonies, np.inf), self.starts, axis = axis)
+        max_other = np.maximum.reduceat(np.where(self.is_target, -np.inf, harmonies), self.starts, axis = axis)
+        return min_target - max_other
+
+    # Whether each datum is correct (data, or weight vectors x data for a weight matrix)
+    def correct(self, weights):
+        weights = np.atleast_2d(np.asarray(weights, dtype=float))
+        gaps = self.gaps(self.harmonies(weights))
+        correct = gaps > 0
+        near = self.exact | (np.abs(gaps) <= self.threshold(weights)[:, np.newaxis])
+        for (k, i) in zip(*np.nonzero(near)):
+            correct[k, i] = self.exact_check(i, weights[k])
+        return correct
+
+    # Check the i-th datum exactly on its own tableau, as optimize() would
+    def exact_check(self, i, weights):
+        (letter, target, n) = self.data[i]
+        return winners_match(self.tableaux[i], weights, target, n)
+
+    # The share of the targets that are correct (one accuracy per weight vector for a weight matrix)
+    def accuracy(self, weights):
+        accuracy = np.dot(self.correct(weights), self.n_targets) / self.total
+        return float(accuracy[0]) if np.ndim(weights) == 1 else accuracy
+
+# Whether the decision of a datum cannot be read from the gap between its targets and its other candidates: duplicate
+# targets, letters with no competitors, and targets merged with a non-target are left to an exact check
+def needs_exact_check(tableau, target, n):
+    target_rows = np.unique(tableau.rows(target))
+    n_target_cands = len(target_rows) if tableau.counts is None else tableau.counts[target_rows].sum()
+    return len(set(target)) != n or n_target_cands != n or len(target_rows) >= len(tableau)
+
+# Whether the winners of a tableau are exactly the targets, as optimize() decides it
+def winners_match(tableau, weights, target, n):
+    winners = select_winners(tableau.harmonies(weights), n, tableau.counts)
+    return set(tableau.cands_of(winners.tolist())) == set(target)
+
+# Evaluate the targets of each of several participants on the weights of each of them
+# participant_data is a list of data (one per participant) and weights a matrix with one row per participant
+# Each letter is scored for every set of weights at once (candidates x constraints times constraints x participants),
+# and each distinct set of targets of the letter is decided for all the weights from that one harmony matrix, with
+# the same exact check of near ties as PackedGrammar
+# Returns (letters, accuracies, failures): the sorted letters of all the data, accuracies[p, q] the accuracy of the
+# weights of p on the targets of q, and failures[p, q, l] whether the weights of p fail a target of q for letters[l]
+def cross_evaluate(grammar, participant_data, weights, tolerance = 1e-9):
+    weights = np.array(weights, dtype=float)
+    n_participants = len(participant_data)
+    letters = sorted(set(letter for data in participant_data for (letter, _, _) in data))
+    letter_index = dict((letter, l) for (l, letter) in enumerate(letters))
+    correct_targets = np.zeros((len(weights), n_participants))
+    failures = np.zeros((len(weights), n_participants, len(letters)), dtype=bool)
+
+    # The participants and frequencies of each distinct set of targets of each letter
+    target_sets = {}
+    for (q, data) in enumerate(participant_data):
+        for (letter, target, n) in data:
+            target_sets.setdefault(letter, {}).setdefault((tuple(target), n), []).append(q)
+
+    for letter in letters:
+        tableau = grammar[letter]
+        harmonies = -np.dot(weights, tableau.dense().T)
+        max_violation = np.abs(tableau.dense()).max() if len(tableau) > 0 else 0
+        threshold = tolerance * (1.0 + max_violation * np.abs(weights).sum(axis = 1))
+        for ((target, n), participants) in target_sets[letter].items():
+            is_target = np.zeros(len(tableau), dtype=bool)
+            is_target[tableau.rows(target)] = True
+            gaps = harmonies[:, is_target].min(axis = 1) - harmonies[:, ~is_target].max(axis = 1, initial = -np.inf)
+            correct = gaps > 0
+            near = np.abs(gaps) <= threshold if not needs_exact_check(tableau, target, n) else np.ones(len(weights), dtype=bool)
+            for p in np.flatnonzero(near).tolist():
+                correct[p] = winners_match(tableau, weights[p], target, n)
+            for q in participants:
+                correct_targets[:, q] += n * correct
+                failures[:, q, letter_index[letter]] |= ~correct
+
+    totals = np.array([sum(n for (_, _, n) in data) for data in participant_data], dtype=float)
+    return (letters, correct_targets / totals, failures)
+
+# The packed grammar of the last grammar and data evaluated, packed again only when they change
+packed_grammars = []
+
+# Get the packed grammar of grammar and data
+def pack(grammar, data):
+    if len(packed_grammars) == 0 or not packed_grammars[0].matches(grammar, data):
+        packed_grammars[:] = [PackedGrammar(grammar, list(data))]
+    return (packed_grammars[0])
+
+# Keep track of which letters in data are correct for the current weights, scoring again only the letters whose
+# decision may have changed. For every datum, the cache follows the exact harmonies of the targets and of the `top`
+# best non-targets (as of the last time the letter was scored), and an upper bound on the harmony of every other
+# non-target: after a change dw, no harmony can rise by more than the sum over constraints of
+# max(-dw.min(violations), -dw.max(violations)). This bounds the gap between the worst target and the best non-target
+# from both sides, and only the letters whose gap could have changed sign are scored again. When many letters are at
+# risk, all of them are scored in one product (incrementally, as long as every harmony is up to date). Any letter
+# whose decision is within `tolerance` of a tie is re-checked exactly, so accuracy() always matches evaluate()
+# The weights are either one vector, or one row per chain (restart), with the letters followed separately per chain
+class HarmonyCache(object):
+    def __init__(self, grammar, data, weights, tolerance = 1e-9, top = 8, refresh = 100):
+        packed = PackedGrammar(grammar, data, tolerance)
+        self.packed = packed
+        self.data = data
+        self.tolerance = tolerance
+        self.refresh = refresh
+        self.n_targets = packed.n_targets
+        self.total = packed.total
+        self.offsets = packed.offsets
+        self.exact = packed.exact
+        self.violations = packed.violations
+        self.max_violation = packed.max_violation
+        self.is_target = packed.is_target
+        self.starts = packed.starts
+        self.sizes = packed.sizes
+        self.letter_of = packed.letter_of
+        is_target = np.split(self.is_target, self.offsets[1:-1])
+
+        # The rows of the targets and of the non-targets of each datum (in the stacked violations); the targets are
+        # padded to the same number for every datum by repeating one of them
+        self.target_rows = [np.flatnonzero(mask) + start for (mask, start) in zip(is_target, self.starts)]
+        self.other_rows = [np.flatnonzero(~mask) + start for (mask, start) in zip(is_target, self.starts)]
+        n_padded = max(len(rows) for rows in self.target_rows)
+        self.target_violations = self.violations[np.array([np.resize(rows, n_padded) for rows in self.target_rows])]
+        self.top = max(1, min(top, max(len(rows) for rows in self.other_rows)))
+        # The smallest and largest violation of each constraint among the non-targets of each datum
+        others = ~self.is_target[:, np.newaxis]
+        self.other_min = np.minimum.reduceat(np.where(others, self.violations, np.inf), self.starts, axis = 0)
+        self.other_max = np.maximum.reduceat(np.where(others, self.violations, -np.inf), self.starts, axis = 0)
+        self.other_min[~np.isfinite(self.other_min)] = 0.0
+        self.other_max[~np.isfinite(self.other_max)] = 0.0
+
+        self.single = np.ndim(weights) == 1
+        self.weights = np.atleast_2d(np.array(weights, dtype=float))
+        self.recompute()
+
+    # Score every candidate again from scratch
+    def recompute(self):
+        n_chains = self.weights.shape[0]
+        self.harmonies = np.zeros((n_chains, len(self.violations)))
+        self.top_rows = np.zeros((n_chains, len(self.data), self.top), dtype=int)
+        self.rest = np.zeros((n_chains, len(self.data)))
+        self.gaps = np.zeros((n_chains, len(self.data)))
+        self.correct = np.zeros((n_chains, len(self.data)), dtype=bool)
+        # The updates applied incrementally to all the harmonies of each chain since they were last all scored from
+        # scratch (-1 when only some letters are up to date)
+        self.n_updates = np.zeros(n_chains, dtype=int)
+        for chain in range(n_chains):
+            self.score_all(chain)
+        self.last_scored = self.harmonies.size
+
+    # The largest total change of weights that cannot flip a decision computed in floating point (for one chain)
+    def threshold(self, chain):
+        return self.tolerance * (1.0 + self.max_violation * np.abs(self.weights[chain]).sum())
+
+    # Score the letters `letters` of one chain from scratch, and decide which of them are correct
+    # Returns the number of candidates scored
+    def score(self, chain, letters):
+        weights = self.weights[chain]
+        harmonies = self.harmonies[chain]
+        for i in letters.tolist():
+            (start, end) = (self.offsets[i], self.offsets[i + 1])
+            harmonies[start:end] = -np.dot(self.violations[start:end], weights)
+            other_rows = self.other_rows[i]
+            other_h = harmonies[other_rows]
+            if len(other_rows) > self.top:
+                best = np.argpartition(-other_h, self.top)
+                self.top_rows[chain, i] = other_rows[best[:self.top]]
+                self.rest[chain, i] = other_h[best[self.top:]].max()
+            else:
+                self.top_rows[chain, i] = np.resize(other_rows if len(other_rows) > 0 else self.target_rows[i], self.top)
+                self.rest[chain, i] = -np.inf
+            max_other = other_h.max() if len(other_rows) > 0 else -np.inf
+            self.gaps[chain, i] = harmonies[self.target_rows[i]].min() - max_other
+        self.n_updates[chain] = -1
+        self.decide(chain, letters)
+        return self.sizes[letters].sum()
+
+    # Score every letter of one chain in one product over all the candidates (following only the best non-target of
+    # each letter exactly), and decide which letters are correct
+    # When all the harmonies are up to date, only the constraints whose weight changed by `delta` are multiplied; every
+    # `refresh` updates they are all scored from scratch again to bound the float drift
+    def score_all(self, chain, delta = None):
+        harmonies = self.harmonies[chain]
+        if delta is not None and 0 <= self.n_updates[chain] < self.refresh:
+            changed = np.flatnonzero(delta)
+            harmonies -= np.dot(self.violations[:, changed], delta[changed])
+            self.n_updates[chain] += 1
+        else:
+            harmonies[:] = -np.dot(self.violations, self.weights[chain])
+            self.n_updates[chain] = 0
+        other_h = np.where(self.is_target, -np.inf, harmonies)
+        max_other = np.maximum.reduceat(other_h, self.starts)
+        self.gaps[chain] = np.minimum.reduceat(np.where(self.is_target, harmonies, np.inf), self.starts) - max_other
+        hits = np.flatnonzero(other_h == max_other[self.letter_of])
+        best_rows = hits[np.unique(self.letter_of[hits], return_index = True)[1]]
+        other_h[best_rows] = -np.inf
+        self.top_rows[chain] = best_rows[:, np.newaxis]
+        self.rest[chain] = np.maximum.reduceat(other_h, self.starts)
+        self.decide(chain, np.arange(len(self.data)))
+        return len(harmonies)
+
+    # Decide which of the freshly scored letters of one chain are correct, checking the near ties exactly
+    def decide(self, chain, letters):
+        self.correct[chain, letters] = self.gaps[chain, letters] > 0
+        near = self.exact[letters] | (np.abs(self.gaps[chain, letters]) <= self.threshold(chain))
+        for i in letters[near].tolist():
+            self.correct[chain, i] = self.exact_check(i, chain)
+
+    # Move the cache to a new set of weights (for a weight matrix, `chains` picks the rows being moved)
+    def shift(self, weights, chains = None):
+        if self.single:
+            chains = [0]
+        elif chains is None:
+            chains = range(self.weights.shape[0])
+        chains = np.asarray(chains).reshape(-1)
+        weights = np.array(weights, dtype=float).reshape(len(chains), -1)
+        delta = weights - self.weights[chains]
+        self.weights[chains] = weights
+
+        # The other non-targets can have risen by at most this much
+        delta = delta[:, np.newaxis, :]
+        self.rest[chains] += np.maximum(-delta * self.other_min, -delta * self.other_max).sum(axis = -1)
+        # The targets and the top non-targets are scored exactly
+        min_target = -np.einsum('dtc,kc->kdt', self.target_violations, weights).max(axis = -1)
+        max_top = -np.einsum('kdjc,kc->kdj', self.violations[self.top_rows[chains]], weights).min(axis = -1)
+        lower = min_target - np.maximum(max_top, self.rest[chains])
+        upper = min_target - max_top
+
+        self.last_scored = 0
+        for (j, chain) in enumerate(chains.tolist()):
+            threshold = self.threshold(chain)
+            self.gaps[chain] = lower[j]
+            self.correct[chain] = lower[j] > threshold
+            at_risk = np.flatnonzero(self.exact | ((lower[j] <= threshold) & (upper[j] >= -threshold)))
+            # When many letters are at risk, one product over all the candidates is faster than one per letter
+            if 2 * self.sizes[at_risk].sum() > self.harmonies.shape[1] or 4 * len(at_risk) > len(self.data):
+                self.last_scored += self.score_all(chain, delta[j, 0])
+            elif len(at_risk) > 0:
+                self.last_scored += self.score(chain, at_risk)
+            else:
+                self.n_updates[chain] = -1
+
+    # Whether the i-th datum is certainly correct, without an exact check (for one chain of a weight matrix)
+    def surely_correct(self, i, chain = None):
+        if chain is None:
+            chain = 0
+        return not self.exact[i] and self.gaps[chain, i] > self.threshold(chain)
+
+    # Check the i-th datum exactly, as evaluate() would
+    def exact_check(self, i, chain = None):
+        return self.packed.exact_check(i, self.weights[0 if chain is None else chain])
+
+    # The accuracy for the current weights (an array with one accuracy per chain for a weight matrix)
+    def accuracy(self, chains = None):
+        if self.single:
+            return float(self.n_targets[self.correct[0]].sum()) / self.total
+        correct = self.correct if chains is None else self.correct[chains]
+        return np.dot(correct, self.n_targets) / self.total
+
 # Adjust the weights
-def adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_frequencies, suppress):
+# monitor(samples, max_accuracy), when given, is asked after every sample whether to give up on this run early
+# trace, when given, gets a record (iteration, samples, letter, accuracy, weights) of every change of the weights (see HGlogger)
+# sampler, when given, draws the data points instead of the sampler set by the sampling setting (see DatumSampler)
+# checkpoint, when given, gets the state of the learner every HGcheckpoint.interval seconds, and a run that finds a saved
+# state in it continues from there exactly as if it had never stopped (see HGcheckpoint)
+# A run that was already learned (with no monitor, trace or sampler) is taken from the result cache (see HGresults)
+def adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_frequencies, suppress, monitor = None, trace = None,
+                   sampler = None, checkpoint = None):
+    key = None
+    if monitor is None and trace is None and sampler is None:
+        key = HGresults.learning_key('adjust_weights', grammar, data, weights, iterations, rate, no_neg, sampling, batch_size)
+    cached = HGresults.get(key)
+    if cached is not None:
+        print 'Found the result of this run in the result cache'
+        return (restore_result(cached))
+    if batch_size is not None:
+        return (remember_result(key, adjust_weights_epochs(iterations, data, grammar, weights, rate, suppress, batch_size, trace)))
+    saved = checkpoint.get('learner') if checkpoint is not None else None
+    if saved is not None:
+        weights = saved['weights']
+
     # Evaluate the data on the initial grammar
     initial_grammar = weights
     initial_grammar_text = 'INITIAL GRAMMAR:\t' + '\t'.join(map(str, [round(wt, 3) for wt in initial_grammar])) + '\n'
     print initial_grammar_text
-    accuracy = evaluate(weights, grammar, data)
+    cache = HarmonyCache(grammar, data, weights)
+    accuracy = cache.accuracy()
     max_accuracy = accuracy
     max_acc_iter = 0
     max_acc_wts = weights
 
-    rand_seed = random.randint(1, 1000)
-    #rand_seed = 562
-    random.seed(rand_seed)
+    if saved is None:
+        rand_seed = random.randint(1, 1000)
+        #rand_seed = 562
+        random.seed(rand_seed)
+    else:
+        rand_seed = saved['rand_seed']
+    if sampler is None:
+        sampler = make_sampler(data, rand_seed)
 
     if suppress == 0:
         print 'ITERATION: 0'
@@ -191,6 +635,12 @@ def adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_fre
     i = 1
     s = 1
     max_acc_s = 1
+    if saved is not None:
+        (initial_grammar, max_accuracy, max_acc_iter, max_acc_wts, max_acc_s, i, s) = saved['progress']
+        random.setstate(saved['random'])
+        np.random.set_state(saved['np_random'])
+        sampler.set_state(saved['sampler'])
+        print 'Resuming from a checkpoint after %d samples' % (s - 1)
     while i <= iterations:
         if max_accuracy == 1:
             print '\nReached an accuracy of 1 after %d iterations (%d total samples)' % (max_acc_iter, s-1)
@@ -199,29 +649,170 @@ def adjust_weights(iterations, data, grammar, weights, rate, sum_of_relative_fre
         elif s >= max(10*len(data), iterations, max_acc_s + max(250, iterations/4)):
             print '\nSampled %d times. Max accuracy first reached %d samples ago.\nStopping now.' % (s, s - max_acc_s)
             break
+        elif monitor is not None and monitor(s, max_accuracy):
+            print '\nSampled %d times. Max accuracy %.2f is too far behind the other runs.\nStopping now.' % (s, max_accuracy)
+            break
         # Otherwise run until n iterations were completed
         else:
-            w = update(next_datum(data, sum_of_relative_frequencies), grammar, weights, rate)
+            d = sampler.next_index()
+            datum = (data[d][0], data[d][1])
+            w = update(datum, grammar, weights, rate)
             if w != weights:
                 weights = w
-                text = 'CURRENT GRAMMAR:\t'
-                for j in range(0, len(weights)):
-                    text = text + str('%.2f\t' % (weights[j]))
-                text = text + '\n'
-                # logf.write(text)
-                accuracy = evaluate(weights, grammar, data)
+                cache.shift(weights)
+                accuracy = cache.accuracy()
                 if accuracy > max_accuracy:
                     max_accuracy = accuracy
                     max_acc_iter = i
                     max_acc_wts = weights
                     max_acc_s = s
                 i += 1
-                text = 'ITERATION: %d\tACCURACY: %s' % (i, str(accuracy))
+                if trace is not None:
+                    trace.record(i - 1, s, datum[0], accuracy, weights)
                 if suppress == 0:
-                    print text
-            else:
-                1 == 1
+                    print 'ITERATION: %d\tACCURACY: %s' % (i, str(accuracy))
             s += 1
+            if checkpoint is not None and checkpoint.due():
+                checkpoint.save('learner', {'weights': weights, 'rand_seed': rand_seed, 'sampler': sampler.get_state(),
+                                            'progress': (initial_grammar, max_accuracy, max_acc_iter, max_acc_wts, max_acc_s, i, s),
+                                            'random': random.getstate(), 'np_random': np.random.get_state()})
+    return (remember_result(key, [max_accuracy, max_acc_iter, max_acc_wts, initial_grammar, max_acc_s, s, rand_seed]))
+
+# Keep the result of a learning run in the result cache, with the states of the random number generators it left behind
+def remember_result(key, final_result):
+    HGresults.put(key, (final_result, random.getstate(), np.random.get_state()))
+    return (final_result)
+
+# Take a result from the result cache, and put the random number generators where the run that learned it left them
+def restore_result(cached):
+    (final_result, random_state, np_random_state) = cached
+    random.setstate(random_state)
+    np.random.set_state(np_random_state)
+    return (final_result)
+
+# Adjust n_restarts weight vectors in lockstep, each with its own initial weights and random number generator
+# All the chains are evaluated together from one harmonies matrix (candidates x chains), and each chain stops on its own
+# criterion exactly as adjust_weights would (a chain with seed k behaves like adjust_weights seeded with k)
+# Returns the adjust_weights-style result of every chain and the index of the best one
+def adjust_weights_restarts(iterations, data, grammar, constraints, n_restarts, rate, uni, sum_of_relative_frequencies, suppress):
+    initial_grammars = [initialize_weights(uni, constraints) for r in range(n_restarts)]
+    rand_seeds = random.sample(xrange(1, 1000000), n_restarts)
+    rngs = [random.Random(seed) for seed in rand_seeds]
+    samplers = [make_sampler(data, rand_seeds[r], rngs[r]) for r in range(n_restarts)]
+
+    # Evaluate the data on the initial grammars
+    cache = HarmonyCache(grammar, data, initial_grammars)
+    weights = [list(w) for w in initial_grammars]
+    max_accuracy = cache.accuracy().tolist()
+    max_acc_iter = [0] * n_restarts
+    max_acc_wts = list(weights)
+    max_acc_s = [1] * n_restarts
+    i = [1] * n_restarts
+    s = [1] * n_restarts
+
+    active = range(n_restarts)
+    while len(active) > 0:
+        running = []
+        changed = []
+        for r in active:
+            if max_accuracy[r] == 1 or i[r] > iterations or \
+                    s[r] >= max(10*len(data), iterations, max_acc_s[r] + max(250, iterations/4)):
+                if suppress == 0:
+                    print 'Restart %d stopped after %d samples with max accuracy %.2f' % (r + 1, s[r], max_accuracy[r])
+                continue
+            running.append(r)
+            d = samplers[r].next_index()
+            # A datum that is already correct leaves the weights (and the random number generator) untouched
+            if cache.surely_correct(d, r):
+                w = weights[r]
+            else:
+                w = update((data[d][0], data[d][1]), grammar, weights[r], rate, rngs[r])
+            if w != weights[r]:
+                weights[r] = w
+                changed.append(r)
+            else:
+                s[r] += 1
+
+        # Evaluate all the chains that changed at once
+        if len(changed) > 0:
+            cache.shift([weights[r] for r in changed], changed)
+            accuracies = cache.accuracy(changed).tolist()
+            for (r, accuracy) in zip(changed, accuracies):
+                if accuracy > max_accuracy[r]:
+                    max_accuracy[r] = accuracy
+                    max_acc_iter[r] = i[r]
+                    max_acc_wts[r] = weights[r]
+                    max_acc_s[r] = s[r]
+                i[r] += 1
+                s[r] += 1
+        active = running
+
+    results = [[max_accuracy[r], max_acc_iter[r], max_acc_wts[r], initial_grammars[r], max_acc_s[r], s[r], rand_seeds[r]]
+               for r in range(n_restarts)]
+    best = max(range(n_restarts), key = lambda r: (max_accuracy[r], -max_acc_s[r]))
+    return (results, best)
+
+# Adjust the weights in epochs: each epoch goes once through the data (in a random order for mini-batches), and each
+# batch moves the weights by the summed change vectors of all the failing pairs of all its data points at once (with the
+# same rounding and no_neg as update()). batch_size = 0 uses the whole data as one batch
+# Stops after `epochs` epochs, at an accuracy of 1, or after an epoch that did not change the weights
+# Returns the same values as adjust_weights, where iterations count the changes of the weights and samples the data
+# points looked at
+def adjust_weights_epochs(epochs, data, grammar, weights, rate, suppress, batch_size = 0, trace = None):
+    initial_grammar = weights
+    print 'INITIAL GRAMMAR:\t' + '\t'.join(map(str, [round(wt, 3) for wt in initial_grammar])) + '\n'
+    cache = HarmonyCache(grammar, data, weights)
+    accuracy = cache.accuracy()
+    max_accuracy = accuracy
+    max_acc_iter = 0
+    max_acc_wts = weights
+
+    rand_seed = random.randint(1, 1000)
+    random.seed(rand_seed)
+    if batch_size <= 0 or batch_size > len(data):
+        batch_size = len(data)
+
+    i = 1
+    s = 1
+    max_acc_s = 1
+    for epoch in range(1, epochs + 1):
+        if max_accuracy == 1:
+            break
+        order = range(len(data))
+        if batch_size < len(data):
+            random.shuffle(order)
+        moved = False
+        for start in range(0, len(data), batch_size):
+            batch = [d for d in order[start:start + batch_size] if not cache.correct[0, d]]
+            s += min(batch_size, len(data) - start)
+            if len(batch) == 0:
+                continue
+            change_vector = sum(batch_change_vector(data[d], grammar, weights, rate) for d in batch)
+            w = np.add(weights, change_vector).tolist()
+            if no_neg == 1:
+                w = [max(wt, 0) for wt in w]
+            if w == weights:
+                continue
+            weights = w
+            moved = True
+            cache.shift(weights)
+            accuracy = cache.accuracy()
+            if accuracy > max_accuracy:
+                max_accuracy = accuracy
+                max_acc_iter = i
+                max_acc_wts = weights
+                max_acc_s = s
+            if trace is not None:
+                trace.record(i, s, '', accuracy, weights)
+            i += 1
+        if suppress == 0:
+            print 'EPOCH: %d\tACCURACY: %s' % (epoch, str(accuracy))
+        if not moved:
+            break
+    if max_accuracy == 1:
+        print '\nReached an accuracy of 1 after %d iterations (%d total samples)' % (max_acc_iter, max_acc_s)
+    else:
+        print '\nStopped after %d epochs (%d total samples). Max accuracy first reached after %d samples.' % (epoch, s - 1, max_acc_s)
     return ([max_accuracy, max_acc_iter, max_acc_wts, initial_grammar, max_acc_s, s, rand_seed])
 
 # Create a log file - override=0 will create a new log for each run. 1 will create a new log once a day.
@@ -248,12 +839,21 @@ def create_log_file(targets_filename, override):
     if override == 1:
         logf = open(log_filename, 'w')
     else:
-        while os.path.isfile(log_filename):
-            counter += 1
-            log_filename = 'Log_%s_%d-%d-%d_%d.txt' % (base_name, now.year, now.month, now.day, counter)
-        logf = open(log_filename, 'w')
+        logf = open_new_file('Log_%s_%d-%d-%d_%%d.txt' % (base_name, now.year, now.month, now.day), counter)
     return (logf)
 
+# Open a new file for writing, numbered with the first counter for which the file does not exist yet
+# The file is claimed atomically, so that runs in parallel never write to the same log
+def open_new_file(filename_pattern, counter = 1):
+    while True:
+        try:
+            os.close(os.open(filename_pattern % (counter), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0666))
+            return (open(filename_pattern % (counter), 'w'))
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+            counter += 1
+
 # Write the best weights, max accuracy, and number of iterations to a log file
 def write_summary(final_result, constraints, logf):
     # Get the best weights
@@ -278,6 +878,7 @@ def write_summary(final_result, constraints, logf):
         return(0)
 
 # Find and print which letters still fail after the specified number of iterations
+# With the rank_table setting, the rank of every target and its competitors also go to <log>.ranks.tsv (see RankTable)
 def find_failures(grammar, data, constraints, final_result, logf, full_success):
     while True:
         #show_harmony = raw_input('\nWould you like to see the harmony and ranking of targets? Y/N\n').upper()
@@ -290,38 +891,23 @@ def find_failures(grammar, data, constraints, final_result, logf, full_success):
     best_weights = final_result[2]
     log_header = '\n\nLetter\tTarget\tHarmony\tRank\tN Cands\tCandidates tied with or ranked higher than the target\n'
     logf.write(log_header)
-    letters_hg = {}
-    failed_letters = []
-    for datum in data:
-        letter = datum[0]
-        target = datum[1]
-        harmonies = {}
-        candidates = grammar[letter].keys()
-
-        # Get the harmonies for all the candidates
-        cand_harmonies = [harmony(grammar[letter][cand], best_weights) for cand in candidates]
-        for i in range(len(candidates)):
-            harmonies[candidates[i]] = cand_harmonies[i]
-        for t in target:
-            failures = []
-            rank = 1
-            ranked_above = []
-            t_h = harmonies[t]
-            for cand in harmonies:
-                if harmonies[cand] >= t_h and cand != t:
-                    ranked_above.append(cand)
-                    rank += 1
-            if show_harmony == 'Y':
-                print 'For the letter %s: the target %s has a Harmony of %.2f. It ranks %d out of %d candidates' % (letter, t, t_h, rank, len(grammar[letter]))
-            log_text = '%s\t%s\t%s\t%d\t%d\t' % (letter, t, t_h, rank, len(grammar[letter]))
-            for cand in ranked_above:
-                if cand not in target:
-                    failures.append(cand)
-            if len(failures) > 0:
-                failed_letters.append((letter, t, failures))
-            log_text = log_text + '\t'.join(failures)
-            logf.write('%s\n' % (log_text))
-            letters_hg[(letter, t)] = (round(t_h, 3), rank, failures, len(grammar[letter]))
+    # The failures of the same weights on the same tableaux and targets may be in the result cache
+    key = HGresults.tableaux_key('find_failures', grammar, data, [float(wt) for wt in best_weights])
+    cached = HGresults.get(key)
+    if cached is not None and rank_table is None and show_harmony == 'N':
+        (failed_letters, log_lines) = cached
+    else:
+        table = RankTable(grammar, data, best_weights)
+        (failed_letters, log_lines) = (table.failures(), table.log_lines())
+        if cached is None:
+            HGresults.put(key, (failed_letters, log_lines))
+        if show_harmony == 'Y':
+            for (letter, t, t_h, rank, n_cands) in zip(table.letters, table.targets, table.harmonies.tolist(),
+                                                       table.ranks.tolist(), table.n_cands.tolist()):
+                print 'For the letter %s: the target %s has a Harmony of %.2f. It ranks %d out of %d candidates' % (letter, t, t_h, rank, n_cands)
+        if rank_table is not None and hasattr(logf, 'name'):
+            table.write_tsv(os.path.splitext(logf.name)[0] + '.ranks.tsv', rank_table if rank_table > 0 else None)
+    logf.write(''.join(log_lines))
     if full_success == 1:
         print '\nALL DONE!!\n'
     else:
@@ -332,18 +918,148 @@ def find_failures(grammar, data, constraints, final_result, logf, full_success):
         print '\nALL DONE!!\n'
     return(failed_letters)
 
+# The ranking of every target of the data under one set of weights, from one product and one sort per letter
+# For every target (in the order of the data): its harmony, its rank (the number of candidates with a harmony at least as
+# high, itself included), the number of candidates tied with it (itself included), and its competitors: the non-target
+# candidates ranked higher than or tied with it (and how many there are). The candidates above a target are the first rows of its letter in
+# harmony order, so ranks and tie groups come from binary searches of the sorted harmonies, and the competitors of a
+# target are read off the sorted rows only when asked for
+class RankTable(object):
+    def __init__(self, grammar, data, weights):
+        weights = np.asarray(weights, dtype=float)
+        self.grammar = grammar
+        self.data = data
+        self.sorted = {} # letter: (rows in harmony order, their harmonies, cumulative candidate counts, harmonies by row)
+        self.is_target = [] # For every datum, which rows of its letter are targets
+        (datums, letters, targets, rows, harmonies, ranks, tied, above, n_competitors) = ([], [], [], [], [], [], [], [], [])
+        for (i, (letter, target, n)) in enumerate(data):
+            tableau = grammar[letter]
+            if letter not in self.sorted:
+                h = tableau.harmonies(weights)
+                order = np.argsort(-h, kind='mergesort')
+                counts = np.ones(len(tableau), dtype=int) if tableau.counts is None else tableau.counts
+                self.sorted[letter] = (order, h[order], np.concatenate(([0], np.cumsum(counts[order]))), h)
+            (order, sorted_h, cumulative, h) = self.sorted[letter]
+            target_rows = tableau.rows(target)
+            target_h = h[target_rows]
+            is_target = np.zeros(len(tableau), dtype=bool)
+            is_target[target_rows] = True
+            self.is_target.append(is_target)
+            # The rows with a harmony at least as high as the target, and the rows of its tie group, as ranges of the
+            # sorted rows
+            end = np.searchsorted(-sorted_h, -target_h, side = 'right')
+            tie_start = np.searchsorted(-sorted_h, -target_h, side = 'left')
+            # The competitors are the candidates at least as high as the target, but for the targets
+            distinct_h = h[tableau.rows(sorted(set(target)))]
+            n_competitors.append(cumulative[end] - (distinct_h[np.newaxis, :] >= target_h[:, np.newaxis]).sum(axis = 1))
+            datums.extend([i] * len(target))
+            letters.extend([letter] * len(target))
+            targets.extend(target)
+            rows.append(target_rows)
+            harmonies.append(target_h)
+            ranks.append(cumulative[end])
+            tied.append(cumulative[end] - cumulative[tie_start])
+            above.append(end)
+        self.datums = np.array(datums, dtype=int)
+        self.letters = letters
+        self.targets = targets
+        self.rows = np.concatenate(rows) if len(rows) > 0 else np.zeros(0, dtype=int)
+        self.harmonies = np.concatenate(harmonies) if len(harmonies) > 0 else np.zeros(0)
+        self.ranks = np.concatenate(ranks) if len(ranks) > 0 else np.zeros(0, dtype=int)
+        self.tied = np.concatenate(tied) if len(tied) > 0 else np.zeros(0, dtype=int)
+        self.above = np.concatenate(above) if len(above) > 0 else np.zeros(0, dtype=int)
+        self.n_competitors = np.concatenate(n_competitors) if len(n_competitors) > 0 else np.zeros(0, dtype=int)
+        self.n_cands = np.array([self.sorted[letter][2][-1] for letter in letters], dtype=int)
+        self.failure_lists = {}
+
+    def __len__(self):
+        return len(self.targets)
+
+    # The rows of the competitors of the j-th target, best first (with merged duplicates, also the row of the target
+    # and of other targets, which may stand for non-targets too)
+    def competitor_rows(self, j):
+        rows = self.sorted[self.letters[j]][0][:self.above[j]]
+        if self.grammar[self.letters[j]].members is not None:
+            return rows
+        return rows[~self.is_target[self.datums[j]][rows]]
+
+    # The competitors of the j-th target, best first (candidates of the same row in the order of the Eval file), or only
+    # the top n of them
+    def competitors(self, j, top = None):
+        if self.ranks[j] <= 1:
+            return []
+        tableau = self.grammar[self.letters[j]]
+        rows = self.competitor_rows(j)
+        if tableau.members is None:
+            return [tableau.cands[row] for row in rows[:top].tolist()]
+        target = self.data[self.datums[j]][1]
+        cands = [c for c in tableau.cands_of(rows.tolist()) if c not in target]
+        return cands if top is None else cands[:top]
+
+    # The competitors of the j-th target in the order of the Eval file (the order of the log of find_failures)
+    def failures_of(self, j):
+        if self.ranks[j] <= 1:
+            return []
+        if j not in self.failure_lists:
+            letter = self.letters[j]
+            tableau = self.grammar[letter]
+            # The rows at least as high as the target (the first self.above[j] rows of the sorted order), as a mask over
+            # the harmonies of the letter, so that no list of rows needs sorting back into the order of the Eval file
+            above = self.sorted[letter][3] >= self.harmonies[j]
+            if tableau.members is None:
+                rows = np.flatnonzero(above & ~self.is_target[self.datums[j]])
+                self.failure_lists[j] = [tableau.cands[row] for row in rows.tolist()]
+            else:
+                # The candidates whose rows are above the target, in the order of the Eval file
+                target = self.data[self.datums[j]][1]
+                self.failure_lists[j] = [tableau.order[i] for i in np.flatnonzero(above[tableau.key_rows()]).tolist()
+                                         if tableau.order[i] not in target]
+        return self.failure_lists[j]
+
+    # The targets with competitors: (letter, target, competitors in the order of the Eval file)
+    def failures(self):
+        failed = []
+        for j in np.flatnonzero(self.ranks > 1).tolist():
+            cands = self.failures_of(j)
+            if len(cands) > 0:
+                failed.append((self.letters[j], self.targets[j], cands))
+        return failed
+
+    # The lines of the log of find_failures, one per target
+    def log_lines(self):
+        lines = []
+        for (j, (letter, t, t_h, rank, n_cands)) in enumerate(zip(self.letters, self.targets, self.harmonies.tolist(),
+                                                                    self.ranks.tolist(), self.n_cands.tolist())):
+            lines.append('%s\t%s\t%s\t%d\t%d\t%s\n' % (letter, t, t_h, rank, n_cands, '\t'.join(self.failures_of(j)) if rank > 1 else ''))
+        return (lines)
+
+    # Write the whole table to a tab-separated file: one line per target with its harmony, rank, tie group, number of
+    # competitors, and its competitors best first (only the top n of them with top = n), each with its harmony
+    def write_tsv(self, filename, top = None):
+        lines = ['Letter\tTarget\tHarmony\tRank\tN Cands\tTied\tN Competitors\tCompetitors%s\n'
+                 % (' (top %d)' % (top) if top is not None else '')]
+        for (j, (letter, t, t_h, rank, tied, n_cands, n_competitors)) in \
+                enumerate(zip(self.letters, self.targets, self.harmonies.tolist(), self.ranks.tolist(), self.tied.tolist(),
+                              self.n_cands.tolist(), self.n_competitors.tolist())):
+            cands = self.competitors(j, top)
+            h = self.sorted[letter][3][self.grammar[letter].rows(cands)].tolist() if len(cands) > 0 else []
+            listed = '\t'.join('%s:%s' % (c, c_h) for (c, c_h) in zip(cands, h))
+            lines.append('%s\t%s\t%s\t%d\t%d\t%d\t%d\t%s\n' % (letter, t, t_h, rank, n_cands, tied, n_competitors, listed))
+        f = open(filename, 'w')
+        f.write(''.join(lines))
+        f.close()
+
 #######################################
 # Functions needed to format the data #
 #######################################
 
-# Get the list of eval file names and the list of participating letters from the directory
+# Get the list of eval file names and the list of participating letters from a directory or a zip archive
 def get_eval_files(eval_dir):
-    os.chdir(eval_dir)
     eval_files = []
     letters = []
-    for file in glob.glob("Eval-*.txt"):
+    for file in HGtableau.list_eval_files(eval_dir):
         eval_files.append(file)
-        letters.append(file.split('-')[1])
+        letters.append(os.path.basename(file).split('-')[1])
     return [eval_files, letters]
 
 # Get the constraints from user input
@@ -351,6 +1067,8 @@ def get_constraints(constraints_filename):
     if constraints_filename[-3:] != 'txt':
         constraints_filename = constraints_filename + '.txt'
     const_path = os.path.isfile(constraints_filename)
+    if not const_path and interactive == 0:
+        raise IOError('Constraints file not found: %s' % (constraints_filename))
     while not const_path:
         while True:
             CorN = raw_input(
@@ -384,33 +1102,24 @@ def get_constraints(constraints_filename):
     return (constraints)
 
 # Get the candidates of a given letter
-def write_letter(input_filename, constraints, grammar):
+# Each letter is stored as a Tableau of small integers (sparse=1 for the CSR-style layout)
+def write_letter(input_filename, constraints, grammar, sparse=0):
     # The script takes an input Eval filename (e.g., Eval-A-uc.txt) as an argument
-    get_input_file = open(input_filename, 'rU')
-    input_file = get_input_file.readlines()
-    get_input_file.close()
-
     # Extract the name of the letter from the filename
     letter = input_filename.split('-')[-2]
+    tableau = HGtableau.read_eval_file(input_filename)
+    active_columns = [const - 1 for const in constraints]
+    grammar[letter] = tableau.select(active_columns, sparse)
+    return (grammar)
 
-    # Extract the number of candidates, and get rid of some unused header rows
-    header = input_file.pop(0)
-    n_cands = int(header.strip().split()[2])
-    temp = input_file.pop(0)
-    temp = input_file.pop(0)
-    temp = input_file.pop(0)
-    grammar[letter] = {}
-
-    # Format each candidate line to extract the candidate code, number, and violations
-    for line in input_file:
-        line = line.strip().split()
-        #cand_code = line[0]
-        cand_num = line[2]
-        violations = line[3:]
-        active_const_v = []
-        for const in constraints:
-            active_const_v.append(violations[const - 1])
-        grammar[letter][cand_num] = active_const_v
+# Get the candidates of all the letters, from the compiled cache of the Eval files when it is up to date
+def get_grammar(filenames, constraints, sparse=0):
+    tableaux = HGtableau.read_eval_files(filenames)
+    active_columns = [const - 1 for const in constraints]
+    grammar = {}
+    for eval_filename in filenames:
+        letter = eval_filename.split('-')[-2]
+        grammar[letter] = tableaux[eval_filename].select(active_columns, sparse)
     return (grammar)
 
 ###############################################
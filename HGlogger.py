@@ -0,0 +1,77 @@
+# Buffered, machine-readable traces of learning runs, written next to the human-readable log files
+# Set trace_format below to 'csv' or 'jsonl' and every run of HGlearn12.main, of a participant in HG_all1's all mode and
+# of an hg job of HGbatch also writes <log>.trace.csv (or .jsonl) with one record per change of the weights:
+# iteration, samples, letter, accuracy and the weight of every constraint
+# The learning loop only appends each record to an in-memory buffer; full buffers are formatted and written in bulk by
+# a background thread. For runs with no terminal output at all, also set HGlearn12.verbose = 0 and use suppress = 1
+
+import os
+import csv
+import json
+import threading
+import Queue
+
+trace_format = None # Set to 'csv' or 'jsonl' to write a trace of every run
+batch = 1000 # Records kept in memory before they are handed to the writer thread
+
+#######################################
+
+# Open the trace of a run next to its log file, or return None when traces are turned off
+# part tells apart several runs logged to the same file (e.g. '_2' for the second attempt of a participant)
+def open_trace(log_filename, constraints, part = ''):
+    if trace_format is None:
+        return None
+    trace_filename = '%s%s.trace.%s' % (os.path.splitext(log_filename)[0], part, trace_format)
+    return TraceWriter(trace_filename, ['iteration', 'samples', 'letter', 'accuracy'], ['w_%s' % (c) for c in constraints])
+
+# Close a trace opened with open_trace (if any)
+def close_trace(trace):
+    if trace is not None:
+        trace.close()
+
+# A trace file fed by the learner and written by a background thread
+# Each record is a tuple of the fields followed by a list of weights (one per constraint)
+class TraceWriter(object):
+    def __init__(self, filename, fields, weight_fields):
+        self.filename = filename
+        self.fields = fields
+        self.weight_fields = weight_fields
+        self.buffer = []
+        self.queue = Queue.Queue(maxsize = 8)
+        self.writer = threading.Thread(target = self.write_batches)
+        self.writer.daemon = True
+        self.writer.start()
+
+    # Keep one record (no formatting happens here)
+    def record(self, *values):
+        self.buffer.append(values)
+        if len(self.buffer) >= batch:
+            self.flush()
+
+    # Hand the buffered records to the writer thread
+    def flush(self):
+        if len(self.buffer) > 0:
+            self.queue.put(self.buffer)
+            self.buffer = []
+
+    # Write the remaining records and wait for the file to be complete
+    def close(self):
+        self.flush()
+        self.queue.put(None)
+        self.writer.join()
+
+    # The writer thread: format and write each batch of records as it arrives
+    def write_batches(self):
+        f = open(self.filename, 'wb' if self.filename.endswith('.csv') else 'w')
+        if self.filename.endswith('.csv'):
+            out = csv.writer(f)
+            out.writerow(self.fields + self.weight_fields)
+        while True:
+            records = self.queue.get()
+            if records is None:
+                break
+            if self.filename.endswith('.csv'):
+                out.writerows([list(record[:-1]) + list(record[-1]) for record in records])
+            else:
+                f.write(''.join(json.dumps(dict(zip(self.fields + ['weights'], record))) + '\n' for record in records))
+        f.close()
@@ -0,0 +1,176 @@
+# Exact solver for Harmonic Grammar weights as a linear program
+# Every target must beat every non-target competitor of its letter by at least `margin`:
+#     (V_competitor - V_target) . w >= margin  for all (target, competitor) pairs, with w >= 0 when no_neg == 1
+# Among the solutions, the one with the smallest sum of (absolute) weights is returned. When there is none, the
+# solver returns a minimal set of (letter, target, competitor) pairs that no weights can satisfy together.
+# SciPy's HiGHS solver is used when it is available; otherwise a self-contained revised simplex on the dual problem
+
+import numpy as np
+import HGlearn12 as hg
+
+try:
+    from scipy.optimize import linprog
+except ImportError:
+    linprog = None
+
+#######################################
+
+# Build the ranking inequalities of the data: one row (V_competitor - V_target) for every target and competitor
+# Identical rows are kept once; pairs[i] = (letter, target, competitor) is one of the pairs that gave row i
+def ranking_rows(grammar, data):
+    blocks = []
+    sources = []
+    for (letter, target, n) in data:
+        tableau = grammar[letter]
+        violations = tableau.dense().astype(np.int32)
+        target_rows = tableau.rows(target)
+        others = np.setdiff1d(np.arange(len(tableau)), target_rows)
+        for (t, t_row) in zip(target, target_rows.tolist()):
+            blocks.append(violations[others] - violations[t_row])
+            sources.append((letter, t, [tableau.cands[row] for row in others]))
+            # A competitor merged into the target's row has the same violations and can never be beaten
+            tied = [c for c in tableau.cands_of([t_row]) if c not in target]
+            if len(tied) > 0:
+                blocks.append(np.zeros((len(tied), tableau.n_constraints), dtype=np.int32))
+                sources.append((letter, t, tied))
+    if len(blocks) == 0:
+        return (np.zeros((0, 0)), [])
+    rows = np.concatenate(blocks)
+    rows, first = np.unique(rows, axis = 0, return_index = True)
+
+    # Find the pair behind each kept row
+    block_ends = np.cumsum([len(block) for block in blocks])
+    pairs = []
+    for i in first.tolist():
+        b = int(np.searchsorted(block_ends, i, side = 'right'))
+        (letter, t, competitors) = sources[b]
+        position = i - (block_ends[b - 1] if b > 0 else 0)
+        pairs.append((letter, t, competitors[position]))
+    return (rows.astype(float), pairs)
+
+# Solve  max margin.sum(y)  s.t.  M^T y <= 1, y >= 0  (the dual of  min sum(x)  s.t.  M x >= margin, x >= 0)
+# with a revised simplex starting from the all-slack basis, which is feasible because the right-hand side is 1
+# Returns ('optimal', x) with the primal solution, or ('infeasible', y) with a ray y >= 0, M^T y <= 0, which
+# proves that M x >= margin has no solution (Farkas)
+def dual_simplex(M, margin = 1.0, max_iterations = None, eps = 1e-9):
+    (n_rows, m) = M.shape
+    if max_iterations is None:
+        max_iterations = 50 * (m + 10) + n_rows
+    basis = range(n_rows, n_rows + m)
+    in_basis = np.zeros(n_rows + m, dtype=bool)
+    in_basis[basis] = True
+    B_inv = np.eye(m)
+    x_B = np.ones(m)
+    c_B = np.zeros(m)
+    degenerate = 0
+    for iteration in range(max_iterations):
+        # Reduced costs of the pair variables (cost -margin) and of the slacks (cost 0)
+        pi = np.dot(c_B, B_inv)
+        reduced = np.concatenate((-margin - np.dot(M, pi), -pi))
+        reduced[in_basis] = 0.0
+        entering_candidates = np.flatnonzero(reduced < -eps)
+        if len(entering_candidates) == 0:
+            return ('optimal', -pi)
+        # Dantzig's rule, falling back to Bland's rule on long runs of degenerate pivots to avoid cycling
+        if degenerate > m:
+            entering = int(entering_candidates[0])
+        else:
+            entering = int(np.argmin(reduced))
+        if entering < n_rows:
+            column = M[entering]
+        else:
+            column = np.zeros(m)
+            column[entering - n_rows] = 1.0
+        u = np.dot(B_inv, column)
+
+        positive = np.flatnonzero(u > eps)
+        if len(positive) == 0:
+            ray = np.zeros(n_rows)
+            if entering < n_rows:
+                ray[entering] = 1.0
+            for (i, b) in enumerate(basis):
+                if b < n_rows:
+                    ray[b] = -u[i]
+            return ('infeasible', np.maximum(ray, 0.0))
+
+        ratios = x_B[positive] / u[positive]
+        theta = ratios.min()
+        ties = positive[ratios <= theta + eps]
+        leaving = int(ties[np.argmin([basis[i] for i in ties])])
+        degenerate = degenerate + 1 if theta <= eps else 0
+
+        # Pivot
+        x_B -= theta * u
+        x_B[leaving] = theta
+        pivot_row = B_inv[leaving] / u[leaving]
+        B_inv -= np.outer(u, pivot_row)
+        B_inv[leaving] = pivot_row
+        in_basis[basis[leaving]] = False
+        in_basis[entering] = True
+        basis[leaving] = entering
+        c_B[leaving] = -margin if entering < n_rows else 0.0
+
+        # Refactorize now and then to keep the inverse accurate
+        if iteration % 50 == 49:
+            B = np.zeros((m, m))
+            for (i, b) in enumerate(basis):
+                if b < n_rows:
+                    B[:, i] = M[b]
+                else:
+                    B[b - n_rows, i] = 1.0
+            B_inv = np.linalg.inv(B)
+            x_B = np.dot(B_inv, np.ones(m))
+    raise RuntimeError('The linear program did not converge after %d iterations' % (max_iterations))
+
+# Check whether M x >= margin has a solution with x >= 0
+def is_feasible(M, margin = 1.0):
+    return dual_simplex(M, margin)[0] == 'optimal'
+
+# Shrink an infeasible set of rows to a minimal one (dropping any row that is not needed for the infeasibility)
+def minimal_infeasible(M, rows, margin = 1.0):
+    rows = list(rows)
+    for row in list(rows):
+        remaining = [r for r in rows if r != row]
+        if len(remaining) > 0 and not is_feasible(M[remaining], margin):
+            rows = remaining
+    return rows
+
+# Find weights that rank every target above all of its competitors
+# Returns (weights, None) when they exist, or (None, violated) with a minimal list of (letter, target, competitor)
+# pairs that cannot all be satisfied by the same weights
+def solve(grammar, data, no_neg = None, margin = 1.0):
+    if no_neg is None:
+        no_neg = hg.no_neg
+    (rows, pairs) = ranking_rows(grammar, data)
+    n_constraints = rows.shape[1]
+    # Free weights are split into positive and negative parts
+    if no_neg == 1:
+        M = rows
+    else:
+        M = np.hstack((rows, -rows))
+
+    solution = None
+    if linprog is not None:
+        try:
+            result = linprog(np.ones(M.shape[1]), A_ub = -M, b_ub = -margin * np.ones(len(M)),
+                             bounds = (0, None), method = 'highs')
+            if result.status == 0:
+                solution = result.x
+            elif result.status != 2:
+                raise ValueError(result.message)
+        except ValueError:
+            # Older SciPy without HiGHS, or a numerical failure: use the simplex below
+            solution = None
+    if solution is None:
+        (status, found) = dual_simplex(M, margin)
+        if status == 'infeasible':
+            support = np.flatnonzero(found > 1e-9)
+            violated = minimal_infeasible(M, support, margin)
+            return (None, [pairs[i] for i in violated])
+        solution = found
+
+    if no_neg == 1:
+        weights = np.maximum(solution, 0.0)
+    else:
+        weights = solution[:n_constraints] - solution[n_constraints:]
+    return ([float(w) for w in weights], None)
@@ -0,0 +1,104 @@
+# Probabilistic Harmonic Grammar: a Maximum Entropy (MaxEnt) learner, optionally with Noisy HG weights
+# The probability of a candidate of a letter is exp(H) / (the sum of exp(H) over all the candidates of the letter),
+# with H = -V.w. Each target of a datum counts as one observed output of its letter (as in get_data, a datum with the
+# targets [t1, t2] is learned when both are the winners), so it adds log p(t1) + log p(t2) to the log-likelihood
+# All the tableaux are stacked into one matrix, so that the log-likelihood and its gradient over all the letters take one
+# product, a log-sum-exp per letter (np.maximum.reduceat / np.add.reduceat) and one weighted sum of violations
+# With noise > 0, each evaluation adds Gaussian noise with that standard deviation to the weights (Noisy HG), so each
+# step follows the gradient at a noisy copy of the weights
+
+import random
+import numpy as np
+import HGlearn12 as hg
+
+sigma2 = None # The variance of a Gaussian prior on the weights (centered on 0); None for no prior
+
+#######################################
+
+# The tableaux of all the data points stacked together, with candidates of identical violations merged into one row
+class StackedTableaux(object):
+    def __init__(self, grammar, data):
+        matrices = []
+        counts = []
+        target_rows = []
+        offsets = [0]
+        for (letter, target, n) in data:
+            tableau = grammar[letter].merge_duplicates()
+            matrices.append(tableau.dense())
+            counts.append(tableau.counts)
+            target_rows.append(tableau.rows(target) + offsets[-1])
+            offsets.append(offsets[-1] + len(tableau))
+        self.violations = np.concatenate(matrices).astype(float)
+        self.log_counts = np.log(np.concatenate(counts))
+        self.starts = np.array(offsets[:-1])
+        self.letter_of = np.repeat(np.arange(len(data)), np.diff(offsets))
+        self.target_rows = np.concatenate(target_rows)
+        self.n_targets = np.array([n for (_, _, n) in data], dtype=float)
+        self.n_observed = self.n_targets.sum()
+        # The summed violations of all the observed targets
+        self.observed = self.violations[self.target_rows].sum(axis = 0)
+
+    # The log-probability of every row (of all the candidates it stands for together) under the given weights
+    def log_probabilities(self, weights):
+        h = -np.dot(self.violations, weights) + self.log_counts
+        max_h = np.maximum.reduceat(h, self.starts)
+        log_z = max_h + np.log(np.add.reduceat(np.exp(h - max_h[self.letter_of]), self.starts))
+        return h - log_z[self.letter_of]
+
+    # The total probability of the targets of every datum under the given weights
+    def target_probabilities(self, weights):
+        p = np.exp(self.log_probabilities(np.asarray(weights, dtype=float)) - self.log_counts)
+        return np.bincount(self.letter_of[self.target_rows], weights = p[self.target_rows], minlength = len(self.starts))
+
+    # The log-likelihood of the targets and its gradient with respect to the weights
+    def objective(self, weights, sigma2 = None):
+        weights = np.asarray(weights, dtype=float)
+        log_p = self.log_probabilities(weights)
+        log_likelihood = (log_p - self.log_counts)[self.target_rows].sum()
+        # Every datum expects its n targets to be drawn from its candidates: n * E[V] - the observed violations
+        gradient = np.dot(np.exp(log_p) * self.n_targets[self.letter_of], self.violations) - self.observed
+        if sigma2 is not None:
+            log_likelihood -= np.dot(weights, weights) / (2 * sigma2)
+            gradient -= weights / sigma2
+        return (log_likelihood, gradient)
+
+# Fit the weights by batch gradient ascent on the log-likelihood (per observed target, so that the rate does not depend on
+# the size of the data), for at most `iterations` steps or until no weight moves by more than `tolerance`
+# The weights with the highest (categorical HG) accuracy are kept, as in HGlearn12.adjust_weights
+# Returns the adjust_weights-style result, and the final weights with their log-likelihood
+def adjust_weights(iterations, data, grammar, weights, rate, suppress, noise = 0.0, tolerance = 1e-6, no_neg = None):
+    if no_neg is None:
+        no_neg = hg.no_neg
+    initial_grammar = weights
+    print 'INITIAL GRAMMAR:\t' + '\t'.join(map(str, [round(wt, 3) for wt in initial_grammar])) + '\n'
+    stack = StackedTableaux(grammar, data)
+    cache = hg.HarmonyCache(hg.prune_grammar(grammar, data, 0), data, weights)
+    max_accuracy = cache.accuracy()
+    max_acc_iter = 0
+    max_acc_wts = weights
+
+    rand_seed = random.randint(1, 1000)
+    rng = np.random.RandomState(rand_seed)
+    w = np.array(weights, dtype=float)
+    i = 0
+    for i in range(1, iterations + 1):
+        noisy = w + rng.normal(0.0, noise, len(w)) if noise > 0 else w
+        (log_likelihood, gradient) = stack.objective(noisy, sigma2)
+        step = rate * gradient / stack.n_observed
+        w = w + step
+        if no_neg == 1:
+            w = np.maximum(w, 0)
+        cache.shift(w)
+        accuracy = cache.accuracy()
+        if accuracy > max_accuracy:
+            max_accuracy = accuracy
+            max_acc_iter = i
+            max_acc_wts = w.tolist()
+        if suppress == 0:
+            print 'ITERATION: %d\tLOG-LIKELIHOOD: %.4f\tACCURACY: %s' % (i, log_likelihood, str(accuracy))
+        if noise == 0 and np.abs(step).max() <= tolerance:
+            print '\nConverged after %d iterations' % (i)
+            break
+    log_likelihood = stack.objective(w, sigma2)[0]
+    print '\nLog-likelihood of the targets: %.4f after %d iterations' % (log_likelihood, i)
+    return ([max_accuracy, max_acc_iter, max_acc_wts, initial_grammar, max_acc_iter, i, rand_seed], w.tolist(), log_likelihood)
@@ -0,0 +1,127 @@
+# Opt-in instrumentation of the learner, to find out where long runs spend their time
+# Set enabled = 1 below (or HGmetrics.enabled = 1 from a script) and every run of HGlearn12.main, of a participant in
+# HG_all1's all mode and of an hg job of HGbatch also writes Log_<...>.metrics.json next to its log file, with:
+# - the calls, total time and own time (without the instrumented functions it calls) of each stage of the learner
+# - the samples drawn, the updates that changed the weights and the candidates whose harmony was computed
+# With profile = 1 the run is also profiled with cProfile, into Log_<...>.prof (see the pstats module)
+# When disabled, nothing is wrapped and the learner runs exactly as before
+
+import os
+import json
+import time
+import cProfile
+import pstats
+import StringIO
+
+enabled = 0 # Set to 1 to record the metrics of every run
+profile = 0 # Set to 1 to also profile every run with cProfile
+
+# The stages that are timed: (name, module name, class name or None, function name)
+stages = [('adjust_weights', 'HGlearn12', None, 'adjust_weights'),
+          ('adjust_weights_restarts', 'HGlearn12', None, 'adjust_weights_restarts'),
+          ('adjust_weights_epochs', 'HGlearn12', None, 'adjust_weights_epochs'),
+          ('next_datum', 'HGlearn12', 'DatumSampler', 'next_index'),
+          ('update', 'HGlearn12', None, 'update'),
+          ('optimize', 'HGlearn12', None, 'optimize'),
+          ('select_winners', 'HGlearn12', None, 'select_winners'),
+          ('evaluate', 'HGlearn12', None, 'evaluate'),
+          ('rank_table', 'HGlearn12', 'RankTable', '__init__'),
+          ('prune_grammar', 'HGlearn12', None, 'prune_grammar'),
+          ('cache_build', 'HGlearn12', 'HarmonyCache', '__init__'),
+          ('cache_shift', 'HGlearn12', 'HarmonyCache', 'shift'),
+          ('cache_accuracy', 'HGlearn12', 'HarmonyCache', 'accuracy'),
+          ('cache_exact_check', 'HGlearn12', 'HarmonyCache', 'exact_check'),
+          ('tableau_harmonies', 'HGtableau', 'Tableau', 'harmonies')]
+
+# The state of the current run
+run = {}
+
+#######################################
+
+# Start recording a run (does nothing unless enabled)
+# learner is the module whose functions are wrapped in place of HGlearn12 (for HGlearn12 run as a script)
+def start(learner = None):
+    if not enabled or 'start' in run:
+        return
+    run.clear()
+    run['start'] = time.time()
+    run['stages'] = dict((name, {'calls': 0, 'seconds': 0.0, 'self_seconds': 0.0}) for (name, _, _, _) in stages)
+    run['counters'] = {'samples': 0, 'accepted_updates': 0, 'candidates_scored': 0}
+    run['stack'] = []
+    run['originals'] = []
+    for (name, module_name, class_name, function_name) in stages:
+        owner = learner if (module_name == 'HGlearn12' and learner is not None) else __import__(module_name)
+        if class_name is not None:
+            owner = getattr(owner, class_name)
+        function = owner.__dict__[function_name]
+        run['originals'].append((owner, function_name, function))
+        setattr(owner, function_name, timed(name, function))
+    if profile:
+        run['profiler'] = cProfile.Profile()
+        run['profiler'].enable()
+
+# Stop recording, and write the metrics of the run next to its log file, with any extra values (e.g. the accuracy)
+# Returns the metrics (None when not enabled)
+def finish(log_filename, extra = None):
+    if 'start' not in run:
+        return None
+    if 'profiler' in run:
+        run['profiler'].disable()
+    for (owner, function_name, function) in run['originals']:
+        setattr(owner, function_name, function)
+
+    metrics = {'log': log_filename, 'seconds': time.time() - run['start'], 'counters': run['counters'],
+               'stages': dict((name, stage) for (name, stage) in run['stages'].items() if stage['calls'] > 0)}
+    if extra is not None:
+        metrics.update(extra)
+    base_filename = os.path.splitext(log_filename)[0]
+    if 'profiler' in run:
+        metrics['profile'] = base_filename + '.prof'
+        run['profiler'].dump_stats(metrics['profile'])
+        text = StringIO.StringIO()
+        pstats.Stats(run['profiler'], stream = text).sort_stats('cumulative').print_stats(15)
+        metrics['profile_top'] = text.getvalue().strip().splitlines()
+    f = open(base_filename + '.metrics.json', 'w')
+    json.dump(metrics, f, indent = 2, sort_keys = True)
+    f.close()
+    run.clear()
+    return (metrics)
+
+# Wrap a function to time its calls, and to count what it does
+def timed(name, function):
+    stage = run['stages'][name]
+    counters = run['counters']
+    stack = run['stack']
+
+    def wrapper(*args, **kwargs):
+        stack.append(0.0)
+        start = time.time()
+        try:
+            result = function(*args, **kwargs)
+        finally:
+            seconds = time.time() - start
+            inner = stack.pop()
+            stage['calls'] += 1
+            stage['seconds'] += seconds
+            stage['self_seconds'] += seconds - inner
+            if len(stack) > 0:
+                stack[-1] += seconds
+        count(name, args, result, counters)
+        return result
+    wrapper.__name__ = function.__name__
+    return wrapper
+
+# Update the counters after a call of a stage
+def count(name, args, result, counters):
+    if name == 'next_datum':
+        counters['samples'] += 1
+    elif name == 'update':
+        if result != args[2]:
+            counters['accepted_updates'] += 1
+    elif name == 'tableau_harmonies':
+        counters['candidates_scored'] += len(args[0])
+    elif name == 'cache_build':
+        counters['candidates_scored'] += args[0].harmonies.size
+    elif name == 'cache_shift':
+        # Only the letters whose decision may have changed are scored again
+        counters['candidates_scored'] += args[0].last_scored
@@ -0,0 +1,84 @@
+# Helpers for running independent learning jobs (ablations, participants, ...) on several cores
+# Read-only data such as the grammar is installed once per worker process rather than sent with every job
+
+import multiprocessing
+import random
+import zlib
+import numpy as np
+
+# The read-only data shared by the jobs of this process
+shared = {}
+
+# Install the shared data in this process (used as the initializer of the pool workers)
+def set_shared(values):
+    shared.clear()
+    shared.update(values)
+
+# A reproducible seed for one job, derived from a base seed and the job's key (e.g. a constraint or a participant ID)
+def derive_seed(base_seed, key):
+    return zlib.crc32('%s:%s' % (base_seed, key)) & 0x7fffffff
+
+# Seed both random number generators used by the learner
+def seed_job(seed):
+    random.seed(seed)
+    np.random.seed(seed)
+
+# Run one job of run_jobs and return it with its position, so that results can arrive in any order
+def call_job(indexed_job):
+    (function, index, job) = indexed_job
+    return (index, function(job))
+
+# Run a function on every job in a pool of processes and return the results in the order of the jobs
+# processes=None uses every core; processes=1 runs the jobs one after the other in this process
+# callback(index, result), when given, is called in this process as soon as each job is done (in order of completion)
+def run_jobs(function, jobs, processes = None, values = None, callback = None):
+    if values is None:
+        values = {}
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(jobs)))
+    results = [None] * len(jobs)
+    if processes == 1:
+        set_shared(values)
+        for (index, job) in enumerate(jobs):
+            results[index] = function(job)
+            if callback is not None:
+                callback(index, results[index])
+        return results
+    pool = multiprocessing.Pool(processes, set_shared, (values,))
+    try:
+        indexed_jobs = [(function, index, job) for (index, job) in enumerate(jobs)]
+        for (index, result) in pool.imap_unordered(call_job, indexed_jobs, chunksize = 1):
+            results[index] = result
+            if callback is not None:
+                callback(index, result)
+    finally:
+        pool.close()
+        pool.join()
+    return results
+
+# A board shared by parallel runs of the GLA, to stop the runs that fall clearly behind the others
+# Every `checkpoint` samples, a run posts its max accuracy so far; a run is dominated when its max accuracy is more
+# than `margin` below the best accuracy that any run had reached by the same number of samples
+class EarlyStopBoard(object):
+    def __init__(self, max_samples, checkpoint = 100, margin = 0.1):
+        self.checkpoint = checkpoint
+        self.margin = margin
+        self.best = multiprocessing.Array('d', max_samples // checkpoint + 1)
+
+    # Post the max accuracy that a run had reached after s samples
+    def post(self, s, max_accuracy):
+        k = min((s + self.checkpoint - 1) // self.checkpoint, len(self.best) - 1)
+        with self.best.get_lock():
+            self.best[k] = max(self.best[k], max_accuracy)
+
+    # Post the max accuracy of a run after s samples, and tell whether the run should stop (the monitor of adjust_weights)
+    def dominated(self, s, max_accuracy):
+        if s % self.checkpoint != 0:
+            return False
+        self.post(s, max_accuracy)
+        k = min(s // self.checkpoint, len(self.best) - 1)
+        # Max accuracy only grows with samples, so a run that got there sooner counts too
+        with self.best.get_lock():
+            best = max(self.best[:k + 1])
+        return max_accuracy < best - self.margin
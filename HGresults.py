@@ -0,0 +1,127 @@
+# A cache of learning results on disk, so that a run that was already done is not learned again
+# Set enabled = 1 below (or HGresults.enabled = 1 from a script) and every run of the learner (HGlearn12.adjust_weights)
+# and every list of failures (HGlearn12.find_failures) is stored under a key made from everything it depends on:
+# - the content of the tableaux of the letters of the targets (the candidates and their violations, not file names), so
+#   the same constraints give the same key whether they come from a constraints file (hg, all) or from dropping one
+#   constraint of a larger set (minusone)
+# - the targets, the initial weights, the iterations, the rate and the settings of HGlearn12
+# - the state of the random number generators when the run starts, which stands for the seed: runs started from the same
+#   seed (the base seed of all and minusone, or the seed column of HGbatch) find each other's results
+# A cached run restores the random number generators to where the learned run left them, so everything after it (e.g.
+# the next attempt of a participant) goes on exactly as if it had been learned again
+# Runs with a monitor (sweep) or a trace (HGlogger) are always learned. The least recently used results are deleted
+# once the cache is larger than max_megabytes
+
+import os
+import zlib
+import random
+import hashlib
+import cPickle
+import numpy as np
+import HGtableau
+
+enabled = 0 # Set to 1 to keep the results of learning runs and reuse them
+directory = 'HGresults' # The folder of the cache (relative to the current directory)
+max_megabytes = 200 # The size of the cache above which the least recently used results are deleted
+
+#######################################
+
+# A key made of any values: numbers, strings, lists, tuples and dictionaries of them, NumPy arrays and tableaux (by their
+# content), or None when the cache is turned off
+def make_key(kind, *values):
+    if not enabled:
+        return None
+    digest = hashlib.sha1(kind)
+    for value in values:
+        add_to_digest(digest, value)
+    return (digest.hexdigest())
+
+# Add one value to a key
+def add_to_digest(digest, value):
+    if isinstance(value, HGtableau.Tableau):
+        digest.update('tableau:%s;' % (value.digest()))
+    elif isinstance(value, np.ndarray):
+        digest.update('array:%s:%r;' % (value.dtype.str, value.shape))
+        digest.update(np.ascontiguousarray(value).tostring())
+    elif isinstance(value, (list, tuple)):
+        digest.update('%s:%d[' % (type(value).__name__, len(value)))
+        for item in value:
+            add_to_digest(digest, item)
+        digest.update(']')
+    elif isinstance(value, dict):
+        add_to_digest(digest, sorted(value.items()))
+    else:
+        digest.update('%r;' % (value,))
+
+# The key of a result computed from some tableaux: the tableaux of the letters of the targets, the targets and any other
+# values
+def tableaux_key(kind, grammar, data, *values):
+    if not enabled:
+        return None
+    letters = sorted(set(letter for (letter, target, n) in data))
+    return make_key(kind, letters, [grammar[letter] for letter in letters], data, *values)
+
+# The key of a learning run, which also depends on the random number generators: the tableaux of the letters of the
+# targets, the targets, the states of the generators and any other values (initial weights, iterations, rate, settings)
+def learning_key(kind, grammar, data, *values):
+    if not enabled:
+        return None
+    return tableaux_key(kind, grammar, data, random.getstate(), np.random.get_state(), *values)
+
+# The file of a result
+def result_filename(key):
+    return os.path.join(directory, key + '.result')
+
+# A cached result (None when there is none, or when the cache is turned off); it becomes the most recently used one
+def get(key):
+    if key is None:
+        return None
+    filename = result_filename(key)
+    try:
+        f = open(filename, 'rb')
+        value = cPickle.loads(zlib.decompress(f.read()))
+        f.close()
+        os.utime(filename, None)
+    except (IOError, OSError, EOFError, zlib.error, cPickle.UnpicklingError):
+        return None
+    return (value)
+
+# Keep a result (nothing happens when the cache is turned off), then delete the least recently used results if the
+# cache grew too large. The file is written under another name and renamed, so parallel runs never read half a result
+def put(key, value):
+    if key is None:
+        return
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass
+    filename = result_filename(key)
+    temporary_filename = '%s.%d.tmp' % (filename, os.getpid())
+    f = open(temporary_filename, 'wb')
+    f.write(zlib.compress(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL)))
+    f.close()
+    if os.name == 'nt' and os.path.exists(filename):
+        os.remove(filename)
+    os.rename(temporary_filename, filename)
+    evict()
+
+# Delete the least recently used results until the cache is no larger than max_megabytes
+def evict():
+    entries = []
+    for name in os.listdir(directory):
+        if name.endswith('.result'):
+            try:
+                stat = os.stat(os.path.join(directory, name))
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+    total = sum(size for (mtime, size, name) in entries)
+    entries.sort()
+    while total > max_megabytes * 2 ** 20 and len(entries) > 1:
+        (mtime, size, name) = entries.pop(0)
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError:
+            pass
+        total -= size
@@ -0,0 +1,149 @@
+# Search for the smallest sets of constraints that are enough for every target to win (a sufficient set)
+# Removing a constraint can never help (a constraint with weight 0 changes nothing), so any set inside an infeasible set
+# is infeasible too, and any set containing a sufficient set is sufficient. The search uses this in two ways:
+# - greedy backward elimination: starting from the full set, drop one constraint at a time (the one with the smallest
+#   weight first) as long as the smaller set is still sufficient. Each smaller set is learned from the weights of the
+#   set it came from, with the column of the dropped constraint removed, so the GLA starts next to a solution. When no
+#   single constraint can be dropped, every smaller set is inside an infeasible one, so the set is minimal
+# - bounded exhaustive search: every set of up to max_size constraints, smallest first, skipping the sets that contain a
+#   sufficient set already found (they are not minimal) and the sets inside a set shown to be infeasible (pruned)
+# A set the GLA cannot learn is checked with the linear program (HGlp), which either finds weights or proves that none
+# exist; with exact = 0 the GLA is trusted instead (faster, but a set may then be taken as infeasible by mistake)
+# The small sets of the exhaustive search are mostly infeasible and far from the weights of any larger set, so with
+# exact = 1 they go to the linear program directly, which decides them much faster than the GLA can fail to learn them
+
+import itertools
+import HGlearn12 as hg
+import HGlp
+
+exact = 1 # 1 = check every set that the GLA cannot learn with the linear program; 0 = take it as infeasible
+
+#######################################
+
+# The sets of constraints tested in a search, and what is known about them
+# A set is a frozenset of indices into the constraints; weights are dictionaries {index: weight}
+class SubsetSearch(object):
+    def __init__(self, grammar, data, constraints, iterations, rate, uni):
+        letters = set(letter for (letter, target, n) in data)
+        self.grammar = dict((letter, tableau) for (letter, tableau) in grammar.items() if letter in letters)
+        self.data = data
+        self.constraints = constraints
+        self.iterations = iterations
+        self.rate = rate
+        self.uni = uni
+        self.sum_of_relative_frequencies = sum(int(datum[2]) for datum in data)
+        self.sufficient = {} # Every sufficient set found, with its weights
+        self.infeasible = [] # The largest sets known to be infeasible (none of them inside another)
+        self.tested = [] # (set, result, method, max accuracy, samples for max) of every set, in the order tested (the
+                         # accuracy and samples are None for a set decided by the linear program alone)
+        self.n_pruned = 0
+
+    # Whether a set is inside a set known to be infeasible
+    def pruned(self, subset):
+        return any(subset <= bad for bad in self.infeasible)
+
+    # Remember an infeasible set (and forget the known infeasible sets inside it)
+    def add_infeasible(self, subset):
+        self.infeasible = [bad for bad in self.infeasible if not bad <= subset] + [subset]
+
+    # Learn the weights of a set of constraints, from the given weights (of a larger set) or from initialize_weights,
+    # or with solve = 1 find them with the linear program only
+    # Returns the weights when every target wins, or None when the set is infeasible
+    def test(self, subset, warm = None, solve = 0):
+        if subset in self.sufficient:
+            return self.sufficient[subset]
+        if len(subset) == 0:
+            return None
+        if self.pruned(subset):
+            self.n_pruned += 1
+            return None
+        columns = sorted(subset)
+        grammar = dict((letter, tableau.select(columns)) for (letter, tableau) in self.grammar.items())
+        (method, accuracy, samples, learned) = ('', None, None, None)
+        if not solve:
+            if warm is None:
+                weights = hg.initialize_weights(self.uni, columns)
+            else:
+                weights = [warm[c] for c in columns]
+            print 'Learning the weights of %d constraints: %s' % (len(columns), ' '.join(str(self.constraints[c]) for c in columns))
+            final_result = hg.adjust_weights(self.iterations, self.data, hg.prune_grammar(grammar, self.data), weights, self.rate,
+                                             self.sum_of_relative_frequencies, 1)
+            (method, accuracy, samples) = ('GLA', final_result[0], final_result[4])
+            learned = final_result[2] if accuracy == 1 else None
+        if learned is None and (exact or solve):
+            (learned, violated) = HGlp.solve(hg.prune_grammar(grammar, self.data, hg.no_neg), self.data, hg.no_neg)
+            method = method + '+LP' if method != '' else 'LP'
+        if learned is None:
+            self.add_infeasible(subset)
+            self.tested.append((subset, 'infeasible', method, accuracy, samples))
+            return None
+        learned = dict(zip(columns, learned))
+        self.sufficient[subset] = learned
+        self.tested.append((subset, 'sufficient', method, accuracy, samples))
+        return learned
+
+    # Greedy backward elimination from a sufficient set and its weights: the minimal set reached, and its weights
+    def eliminate(self, subset, weights):
+        while True:
+            for c in sorted(subset, key = lambda c: (abs(weights[c]), c)):
+                child_weights = self.test(subset - frozenset([c]), weights)
+                if child_weights is not None:
+                    (subset, weights) = (subset - frozenset([c]), child_weights)
+                    break
+            else:
+                return (subset, weights)
+
+    # Every minimal sufficient set of up to max_size constraints, smallest first, each learned from the given weights
+    # (or, with exact = 1, found with the linear program)
+    def exhaustive(self, max_size, warm = None):
+        minimal = []
+        for size in range(1, min(max_size, len(self.constraints)) + 1):
+            for combination in itertools.combinations(range(len(self.constraints)), size):
+                subset = frozenset(combination)
+                if any(found <= subset for found in minimal):
+                    continue
+                if self.test(subset, warm, exact) is not None:
+                    minimal.append(subset)
+        return minimal
+
+# Search for the smallest sufficient sets of the constraints: backward elimination from the full set, then every set of
+# up to max_size constraints (none when max_size is 0)
+# Returns the search, the set found by backward elimination (None when even the full set is infeasible) and the
+# minimal sets of up to max_size constraints
+def search(grammar, data, constraints, iterations, rate, uni, max_size = 0):
+    searcher = SubsetSearch(grammar, data, constraints, iterations, rate, uni)
+    full = frozenset(range(len(constraints)))
+    weights = searcher.test(full)
+    if weights is None:
+        return (searcher, None, [])
+    (smallest, smallest_weights) = searcher.eliminate(full, weights)
+    minimal = searcher.exhaustive(max_size, weights) if max_size > 0 else []
+    return (searcher, smallest, minimal)
+
+# Write the sets tested in a search and the sets found to a log file
+def write_log(searcher, smallest, minimal, max_size, logf):
+    text = '\nSets tested:\t%d\nSets skipped inside infeasible sets:\t%d\n' % (len(searcher.tested), searcher.n_pruned)
+    if smallest is None:
+        text = text + '\nNo weights of all the constraints make every target win\n'
+    else:
+        text = text + '\nSmallest set found by backward elimination (%d of %d constraints):\t%s\nGrammar:\t%s\n' \
+                      % (len(smallest), len(searcher.constraints), set_names(searcher, smallest), set_grammar(searcher, smallest))
+    if max_size > 0:
+        text = text + '\nMinimal sets of up to %d constraints:\t%d\n' % (max_size, len(minimal))
+        for subset in minimal:
+            text = text + '%d\t%s\n' % (len(subset), set_grammar(searcher, subset))
+    logf.write(text)
+    print text
+    logf.write('\n\nSize\tResult\tMethod\tMax Accuracy\tSamples for Max\tConstraints\n')
+    for (subset, result, method, accuracy, samples) in searcher.tested:
+        # The sets decided by the linear program alone have no accuracy or samples
+        logf.write('%d\t%s\t%s\t%s\t%s\t%s\n' % (len(subset), result, method, '%.2f' % (accuracy) if accuracy is not None else '',
+                                                samples if samples is not None else '', set_names(searcher, subset)))
+
+# The names of the constraints of a set, tab-separated
+def set_names(searcher, subset):
+    return '\t'.join(str(searcher.constraints[c]) for c in sorted(subset))
+
+# The constraints of a sufficient set with their weights (name:weight), tab-separated
+def set_grammar(searcher, subset):
+    return '\t'.join('%s:%s' % (searcher.constraints[c], round(searcher.sufficient[subset][c], 2)) for c in sorted(subset))
@@ -0,0 +1,376 @@
+# Compact storage for the tableaux of constraint violations read from the Eval files
+# Each letter is held as one small-integer array of violations (optionally in a sparse CSR-style layout,
+# since most cells are 0) together with an index from candidate number to row
+# The parsed Eval files of a folder are also kept in a compiled cache file, which is loaded instead of re-parsing the
+# text files as long as their size and modification time (or, failing that, their content hash) are unchanged
+# Eval files can be read from a folder or straight from a zip archive (e.g. EvalFiles.zip), where a file is named by
+# the archive path followed by its path inside the archive
+
+import os
+import re
+import glob
+import time
+import fnmatch
+import hashlib
+import zipfile
+import numpy as np
+
+EVAL_CACHE_NAME = '.HGevalcache.npz'
+EVAL_CACHE_VERSION = 1
+
+#######################################
+
+# Pick the smallest integer type that can hold all the violations of a tableau
+def violation_dtype(violations):
+    if violations.size == 0:
+        return np.int8
+    largest = max(abs(int(violations.max())), abs(int(violations.min())))
+    for dtype in (np.int8, np.int16, np.int32):
+        if largest <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+# The violations of all the candidates of one letter
+# Behaves like the old {candidate number: violations} dictionary (keys, len, in, [cand_num]),
+# but computes the harmonies of all candidates in a single array operation
+# After merge_duplicates(), each row stands for all the candidates in members[row] (cands[row] is the first of them),
+# and len() is the number of rows while keys() still lists every candidate number
+class Tableau(object):
+    def __init__(self, cands, violations, sparse=0, members=None, order=None):
+        violations = np.asarray(violations)
+        if violations.ndim != 2:
+            violations = violations.reshape((len(cands), -1))
+        self.cands = [str(c) for c in cands]
+        self.members = members
+        if members is None:
+            self.counts = None
+            self.index = dict((c, i) for i, c in enumerate(self.cands))
+        else:
+            self.counts = np.array([len(m) for m in members])
+            self.index = dict((c, i) for i, m in enumerate(members) for c in m)
+            # The order of all the candidate numbers in the Eval file
+            if order is None:
+                order = [c for m in members for c in m]
+            self.order = order
+        self.n_cands = violations.shape[0]
+        self.n_constraints = violations.shape[1]
+        dtype = violation_dtype(violations)
+        index_dtype = np.uint8 if self.n_constraints <= 2 ** 8 else np.int16 if self.n_constraints <= 2 ** 15 else np.int32
+        # The sparse layout is only kept when it is smaller than the dense one (a value and a column index for every
+        # violation, and a row pointer for every candidate)
+        if sparse:
+            n_nonzero = np.count_nonzero(violations)
+            sparse_nbytes = n_nonzero * (np.dtype(dtype).itemsize + np.dtype(index_dtype).itemsize) + 4 * (self.n_cands + 1)
+            sparse = 1 if sparse_nbytes < violations.size * np.dtype(dtype).itemsize else 0
+        self.sparse = sparse
+        if sparse:
+            rows, cols = np.nonzero(violations)
+            self.data = violations[rows, cols].astype(dtype)
+            self.indices = cols.astype(index_dtype)
+            self.indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=self.n_cands)))).astype(np.int32)
+            self.violations = None
+        else:
+            self.violations = np.ascontiguousarray(violations, dtype=dtype)
+
+    def __len__(self):
+        return self.n_cands
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, cand):
+        return cand in self.index
+
+    def __getitem__(self, cand):
+        return self.row(self.index[cand])
+
+    def keys(self):
+        if self.members is None:
+            return list(self.cands)
+        return list(self.order)
+
+    # The candidate numbers that a list of rows stand for
+    def cands_of(self, rows):
+        if self.members is None:
+            return [self.cands[row] for row in rows]
+        return [c for row in rows for c in self.members[row]]
+
+    # The row of every candidate, in the order of keys()
+    def key_rows(self):
+        if self.members is None:
+            return np.arange(self.n_cands)
+        if not hasattr(self, '_key_rows'):
+            self._key_rows = np.array([self.index[c] for c in self.order], dtype=np.intp)
+        return self._key_rows
+
+    # The violations of the candidate in a given row
+    def row(self, i):
+        if not self.sparse:
+            return self.violations[i]
+        row = np.zeros(self.n_constraints, dtype=self.data.dtype)
+        start, end = self.indptr[i], self.indptr[i + 1]
+        row[self.indices[start:end]] = self.data[start:end]
+        return row
+
+    # The rows of a list of candidate numbers
+    def rows(self, cands):
+        return np.array([self.index[c] for c in cands], dtype=np.intp)
+
+    # The full violations matrix (n_cands x n_constraints)
+    def dense(self):
+        if not self.sparse:
+            return self.violations
+        matrix = np.zeros((self.n_cands, self.n_constraints), dtype=self.data.dtype)
+        matrix[np.repeat(np.arange(self.n_cands), np.diff(self.indptr)), self.indices] = self.data
+        return matrix
+
+    # Compute the harmony of every candidate for a given set of weights
+    # (as 0.0 - V.w, so that a candidate with no violations has a harmony of 0.0, not -0.0, as in the logs)
+    def harmonies(self, weights):
+        weights = np.asarray(weights, dtype=float)
+        if not self.sparse:
+            return 0.0 - np.dot(self.violations, weights)
+        if not hasattr(self, '_row_ids'):
+            self._row_ids = np.repeat(np.arange(self.n_cands), np.diff(self.indptr))
+        return 0.0 - np.bincount(self._row_ids, weights=self.data * weights[self.indices], minlength=self.n_cands)
+
+    # A new tableau with only the given (0-based) columns
+    def select(self, columns, sparse=None):
+        if sparse is None:
+            sparse = self.sparse
+        return Tableau(self.cands, self.dense()[:, columns], sparse, self.members, getattr(self, 'order', None))
+
+    # A new tableau with only the given rows
+    def keep(self, rows):
+        if self.members is None:
+            return Tableau([self.cands[row] for row in rows], self.dense()[rows], self.sparse)
+        members = [self.members[row] for row in rows]
+        kept = set(c for m in members for c in m)
+        order = [c for c in self.order if c in kept]
+        return Tableau([self.cands[row] for row in rows], self.dense()[rows], self.sparse, members, order)
+
+    # A new tableau where the candidates with identical violations share one row (in order of first appearance)
+    def merge_duplicates(self):
+        violations = self.dense()
+        if self.n_cands == 0:
+            return self
+        unique, first, inverse = np.unique(violations, axis = 0, return_index = True, return_inverse = True)
+        order = np.argsort(first)
+        new_row = np.empty(len(order), dtype=np.intp)
+        new_row[order] = np.arange(len(order))
+        members = [[] for row in order]
+        for (i, row) in enumerate(new_row[inverse].tolist()):
+            members[row].extend(self.members[i] if self.members is not None else [self.cands[i]])
+        return Tableau([self.cands[i] for i in first[order]], violations[first[order]], self.sparse, members, self.keys())
+
+    # A hash of the content of the tableau (the candidates each row stands for and their violations), whatever its layout
+    def digest(self):
+        if not hasattr(self, '_digest'):
+            digest = hashlib.sha1('%d:%d;' % (self.n_cands, self.n_constraints))
+            digest.update('\t'.join(self.cands))
+            if self.members is not None:
+                digest.update(';' + '\t'.join(','.join(m) for m in self.members))
+            digest.update(';')
+            digest.update(np.ascontiguousarray(self.dense(), dtype=np.int64).tostring())
+            self._digest = digest.hexdigest()
+        return self._digest
+
+    # Number of bytes used by the violations and the index arrays
+    def nbytes(self):
+        if self.sparse:
+            return self.data.nbytes + self.indices.nbytes + self.indptr.nbytes
+        return self.violations.nbytes
+
+# Drop the non-target rows that are harmonically bounded by another non-target row (no more violations of any
+# constraint, and fewer of some). With non-negative weights such a row never has a higher harmony than the row bounding
+# it, so the best non-target of the letter, and with it whether the targets win, stays the same for any weights.
+# Expects a tableau with no duplicate rows (see merge_duplicates)
+def drop_bounded(tableau, target_rows):
+    violations = tableau.dense().astype(np.int32)
+    is_target = np.zeros(len(tableau), dtype=bool)
+    is_target[target_rows] = True
+    others = np.flatnonzero(~is_target)
+    # Any bounding row has fewer violations in total, so checking rows by increasing total only against the rows kept
+    # so far (which are never bounded themselves) finds every bounded row
+    others = others[np.argsort(violations[others].sum(axis = 1), kind = 'mergesort')]
+    kept = np.empty((len(others), tableau.n_constraints), dtype=np.int32)
+    n_kept = 0
+    keep = is_target.copy()
+    for row in others.tolist():
+        if n_kept > 0 and np.all(kept[:n_kept] <= violations[row], axis = 1).any():
+            continue
+        kept[n_kept] = violations[row]
+        n_kept += 1
+        keep[row] = True
+    return tableau.keep(np.flatnonzero(keep))
+
+#######################################
+# Reading the Eval files              #
+#######################################
+
+# List the Eval files of a folder or of a zip archive
+def list_eval_files(source):
+    if os.path.isfile(source) and zipfile.is_zipfile(source):
+        archive = zipfile.ZipFile(source)
+        members = [name for name in archive.namelist() if fnmatch.fnmatch(name.split('/')[-1], 'Eval-*.txt')]
+        archive.close()
+        return [os.path.join(source, member) for member in members]
+    return glob.glob(os.path.join(source, 'Eval-*.txt'))
+
+# Split the name of a file inside a zip archive into (archive, member); files on disk give (None, filename)
+def split_archive_path(filename):
+    head = filename
+    while head and not os.path.exists(head):
+        head = os.path.dirname(head)
+    if head and head != filename and os.path.isfile(head) and zipfile.is_zipfile(head):
+        return (head, os.path.relpath(filename, head).replace(os.sep, '/'))
+    return (None, filename)
+
+# Read the whole text of an Eval file (from disk or from a zip archive)
+def read_eval_text(filename):
+    (archive, member) = split_archive_path(filename)
+    if archive is None:
+        f = open(filename, 'rb')
+        text = f.read()
+        f.close()
+    else:
+        z = zipfile.ZipFile(archive)
+        text = z.read(member)
+        z.close()
+    return text
+
+# The first field of every line (the candidate code, which is not a number)
+first_fields = re.compile(r'^[ \t]*\S+', re.MULTILINE)
+
+# Read one Eval file, keeping the violations of all the constraints
+# The four header rows give the number of candidates and the constraint columns; the body is parsed in bulk into one
+# preallocated array of (score, candidate number, violations) per candidate
+def read_eval_file(input_filename):
+    text = read_eval_text(input_filename)
+    header = text.split('\n', 4)
+    n_cands = int(header[0].split()[2])
+    n_columns = len(header[3].split()) - 1
+    body = first_fields.sub('', header[4]) if len(header) > 4 else ''
+    values = np.fromstring(body, dtype=np.int64, sep=' ', count=n_cands * n_columns)
+    if len(values) != n_cands * n_columns:
+        raise ValueError('%s: expected %d candidates but found %d' % (input_filename, n_cands, len(values) // max(n_columns, 1)))
+    values = values.reshape((n_cands, n_columns))
+    return Tableau([str(c) for c in values[:, 1].tolist()], values[:, 2:])
+
+# The size and modification time of a file (for a file in a zip archive, as recorded in the archive)
+def file_signature(filename):
+    (archive, member) = split_archive_path(filename)
+    if archive is None:
+        stat = os.stat(filename)
+        return (stat.st_size, stat.st_mtime)
+    z = zipfile.ZipFile(archive)
+    info = z.getinfo(member)
+    z.close()
+    return (info.file_size, time.mktime(info.date_time + (0, 0, -1)))
+
+# The SHA-1 hash of the content of a file (for a file in a zip archive, the CRC-32 recorded in the archive)
+def file_hash(filename):
+    (archive, member) = split_archive_path(filename)
+    if archive is None:
+        f = open(filename, 'rb')
+        digest = hashlib.sha1(f.read()).hexdigest()
+        f.close()
+        return digest
+    z = zipfile.ZipFile(archive)
+    digest = 'crc32:%08x' % (z.getinfo(member).CRC)
+    z.close()
+    return digest
+
+# The compiled cache of a list of Eval files: next to the Eval files in a folder, or next to their zip archive
+def eval_cache_filename(filenames):
+    (archive, member) = split_archive_path(filenames[0])
+    if archive is None:
+        return os.path.join(os.path.dirname(filenames[0]), EVAL_CACHE_NAME)
+    return os.path.join(os.path.dirname(archive), '.%s%s' % (os.path.basename(archive), EVAL_CACHE_NAME))
+
+# Load a compiled cache: {file name: (size, mtime, hash, tableau)}, or an empty dict if there is no usable cache
+def load_eval_cache(cache_filename):
+    if not os.path.isfile(cache_filename) or not zipfile.is_zipfile(cache_filename):
+        return {}
+    try:
+        cache = np.load(cache_filename)
+        if int(cache['version']) != EVAL_CACHE_VERSION:
+            return {}
+        offsets = cache['offsets']
+        widths = cache['widths']
+        cands = cache['cands'].tolist()
+        violations = cache['violations']
+        sizes = cache['sizes'].tolist()
+        mtimes = cache['mtimes'].tolist()
+        hashes = cache['hashes'].tolist()
+        entries = {}
+        for i, name in enumerate(cache['names'].tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            tableau = Tableau(cands[start:end], violations[start:end, :widths[i]])
+            entries[name] = (sizes[i], mtimes[i], hashes[i], tableau)
+        cache.close()
+        return entries
+    except Exception:
+        # A missing array, a truncated or corrupt file (BadZipfile, zlib or pickle errors): parse the Eval files again
+        return {}
+
+# Write a compiled cache with all the letters stacked into one violations matrix
+def save_eval_cache(cache_filename, entries):
+    names = sorted(entries.keys())
+    tableaux = [entries[name][3] for name in names]
+    widths = [t.n_constraints for t in tableaux]
+    violations = np.zeros((sum(len(t) for t in tableaux), max(widths) if widths else 0), dtype=np.int16)
+    offsets = [0]
+    cands = []
+    for t in tableaux:
+        violations[offsets[-1]:offsets[-1] + len(t), :t.n_constraints] = t.dense()
+        offsets.append(offsets[-1] + len(t))
+        cands.extend(t.cands)
+    violations = violations.astype(violation_dtype(violations))
+    # Parallel runs (pool workers, HGbatch jobs) may save the same cache at once, so each writes its own file
+    temp_filename = '%s.%d.tmp' % (cache_filename, os.getpid())
+    try:
+        f = open(temp_filename, 'wb')
+        np.savez(f, version = EVAL_CACHE_VERSION, names = np.array(names), offsets = np.array(offsets),
+                 widths = np.array(widths), cands = np.array(cands), violations = violations,
+                 sizes = np.array([entries[name][0] for name in names], dtype=np.int64),
+                 mtimes = np.array([entries[name][1] for name in names], dtype=float),
+                 hashes = np.array([entries[name][2] for name in names]))
+        f.close()
+        if os.name == 'nt' and os.path.exists(cache_filename):
+            os.remove(cache_filename)
+        os.rename(temp_filename, cache_filename)
+    except (IOError, OSError):
+        # A read-only Eval folder just means no cache
+        if os.path.isfile(temp_filename):
+            os.remove(temp_filename)
+
+# Read a list of Eval files (all in the same folder) through the compiled cache: {filename: tableau}
+# Files whose size and mtime match the cache are taken from it; otherwise the content hash decides, and only
+# the files that really changed are parsed again
+def read_eval_files(filenames, cache_filename = None):
+    if len(filenames) == 0:
+        return {}
+    if cache_filename is None:
+        cache_filename = eval_cache_filename(filenames)
+    cached = load_eval_cache(cache_filename)
+    entries = {}
+    tableaux = {}
+    changed = len(cached) != len(filenames)
+    for filename in filenames:
+        name = os.path.basename(filename)
+        (size, mtime) = file_signature(filename)
+        entry = cached.get(name)
+        if entry is not None and entry[0] == size and entry[1] == mtime:
+            entries[name] = entry
+        else:
+            digest = file_hash(filename)
+            if entry is not None and entry[0] == size and entry[2] == digest:
+                entries[name] = (size, mtime, digest, entry[3])
+            else:
+                entries[name] = (size, mtime, digest, read_eval_file(filename))
+            changed = True
+        tableaux[filename] = entries[name][3]
+    if changed:
+        save_eval_cache(cache_filename, entries)
+    return tableaux